@@ -0,0 +1,63 @@
+"""
+Per-call overhead of @ooze.magic for a Flask-style route.
+
+Run from the project root with:
+
+    $ python -m benchmarks.bench_magic
+"""
+import functools
+import inspect
+import timeit
+
+import ooze
+
+
+def legacy_magic(func):
+    """The original magic wrapper, which inspected the function and resolved on every call."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        needed_args = inspect.signature(func)
+        if len(needed_args.parameters) <= len(args) + len(kwargs):
+            return func(*args, **kwargs)
+        ooze_kwargs = {}
+        for idx, key in enumerate(needed_args.parameters.keys()):
+            if idx < len(args):
+                ooze_kwargs[key] = args[idx]
+            elif key in kwargs:
+                ooze_kwargs[key] = kwargs[key]
+            else:
+                ooze_kwargs[key] = ooze.resolve(key)
+        return func(*[], **ooze_kwargs)
+
+    return wrapper
+
+
+ooze.provide_static('db_pool', object())
+ooze.provide_static('template_name', 'counter.html')
+
+
+@ooze.provide
+class CounterRepository:
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+
+def show_counter(counter_id, counterrepository, template_name):
+    return counter_id
+
+
+def main(number=100_000):
+    routes = {
+        'undecorated': lambda: show_counter(1, None, None),
+        'legacy magic': functools.partial(legacy_magic(show_counter), 1),
+        'planned magic': functools.partial(ooze.magic(show_counter), 1),
+    }
+    for name, route in routes.items():
+        route()
+        seconds = min(timeit.repeat(route, number=number, repeat=5))
+        print(f"{name:>15}: {seconds / number * 1_000_000:8.2f} us/call")
+
+
+if __name__ == '__main__':
+    main()
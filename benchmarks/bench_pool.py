@@ -0,0 +1,104 @@
+"""
+Borrow/return throughput of ooze.pool.Pool with 64 threads contending for 8 items.
+
+Run from the project root with:
+
+    $ python -m benchmarks.bench_pool
+"""
+import threading
+import time
+
+import ooze.pool
+
+
+class LegacyPoolItem:
+    def __init__(self, item, pool):
+        self.item = item
+        self.pool = pool
+
+    def __enter__(self):
+        return self.item
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.return_item(self.item)
+
+
+class LegacyPool:
+    """The original pool: one RLock around everything and list.pop(0)."""
+
+    def __init__(self, create, reclaim=None, teardown=None, pool_size=5):
+        self.create = create
+        self.reclaim = reclaim
+        self.teardown = teardown
+        self.pool_size = pool_size
+        self.items = []
+        self._lock = threading.RLock()
+
+    def item(self):
+        with self._lock:
+            if self.items:
+                return LegacyPoolItem(self.items.pop(0), self)
+            else:
+                return LegacyPoolItem(self.create(), self)
+
+    def return_item(self, item):
+        with self._lock:
+            while len(self.items) >= self.pool_size:
+                item = self.items.pop(0)
+                if self.teardown:
+                    self.teardown(item)
+            if self.reclaim:
+                self.reclaim(item)
+            self.items.append(item)
+
+
+def contend(pool, threads=64, borrows=2_000, hold=0.0):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(borrows):
+            with pool.item():
+                if hold:
+                    time.sleep(hold)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * borrows / (time.perf_counter() - started)
+
+
+def main():
+    created = []
+
+    def create():
+        created.append(object())
+        return created[-1]
+
+    def slow_create():
+        time.sleep(0.005)
+        return create()
+
+    scenarios = {
+        'no work': dict(create=create, borrows=2_000, hold=0.0),
+        'slow connect, 0.5ms queries': dict(create=slow_create, borrows=50, hold=0.0005),
+    }
+    for scenario, options in scenarios.items():
+        print(f"{scenario}:")
+        pools = {
+            'legacy pool': LegacyPool(options['create'], pool_size=8),
+            'pool': ooze.pool.Pool(options['create'], pool_size=8),
+            'bounded pool': ooze.pool.Pool(options['create'], pool_size=8, max_size=8),
+        }
+        for name, pool in pools.items():
+            created.clear()
+            rate = contend(pool, borrows=options['borrows'], hold=options['hold'])
+            print(f"  {name:>12}: {rate:12,.0f} borrows/s, {len(created)} items created")
+
+
+if __name__ == '__main__':
+    main()
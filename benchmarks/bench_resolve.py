@@ -0,0 +1,44 @@
+"""
+Cost of repeated ooze.resolve() calls for names that are already in the graph.
+
+Run from the project root with:
+
+    $ python -m benchmarks.bench_resolve
+"""
+import os
+import timeit
+
+import ooze
+
+
+def uncached_resolve(name):
+    """The original resolve, which checked the graph and walked the resolvers on every call."""
+    ooze._instantiate_objects()
+    return ooze._resolve_dependency(name)
+
+
+os.environ['BENCH_RESOLVE_REGION'] = 'eu-west-1'
+ooze.reload_environment()
+ooze.provide_static('db_pool', object())
+
+
+@ooze.provide
+class CounterRepository:
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+
+def main(number=200_000):
+    for name in ('counterrepository', 'bench_resolve_region'):
+        lookups = {
+            'uncached': lambda: uncached_resolve(name),
+            'cached': lambda: ooze.resolve(name),
+        }
+        for kind, lookup in lookups.items():
+            lookup()
+            seconds = min(timeit.repeat(lookup, number=number, repeat=5))
+            print(f"{name:>20} {kind:>9}: {seconds / number * 1_000_000:8.3f} us/call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare two runs of the benchmark suite and flag the benchmarks that got slower.
+
+    $ python -m benchmarks.compare baseline.json results.json [--threshold 0.2]
+
+Exits with status 1 when any benchmark is more than threshold (20% by default) slower than
+in the baseline, so it can fail a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Rows of (name, baseline, current, change) for the benchmarks in both runs, and the names
+    of those that are more than threshold slower.  change is the relative difference, positive
+    when current is slower.
+    """
+    rows = []
+    regressions = []
+    for name, before in baseline['results'].items():
+        after = current['results'].get(name)
+        if after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def _describe(run):
+    environment = run.get('environment', {})
+    return ' '.join(str(environment[key]) for key in ('ooze', 'commit', 'python') if environment.get(key))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare')
+    parser.add_argument('baseline', help='results of the suite before the change')
+    parser.add_argument('current', help='results of the suite after the change')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slow down that counts as a regression, 0.2 for 20%%')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as infile:
+        baseline = json.load(infile)
+    with open(args.current) as infile:
+        current = json.load(infile)
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    print(f"baseline: {_describe(baseline)}")
+    print(f" current: {_describe(current)}")
+    for name, before, after, change in rows:
+        flag = '  <- slower' if name in regressions else ''
+        print(f"{name:>40}: {before:12.3f} -> {after:12.3f} us {change:+8.1%}{flag}")
+    for name in sorted(current['results'].keys() - baseline['results'].keys()):
+        print(f"{name:>40}: new")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+The benchmark suite: startup, steady-state resolve, @ooze.magic overhead, resolver
+fall-through and pool contention, on synthetic graphs of 10, 100 and 1000 providers.
+
+Run from the project root with:
+
+    $ python -m benchmarks.suite --output results.json
+
+Every result is the best of several runs, in microseconds per operation, so lower is
+better.  Compare two runs, for example before and after a change, with:
+
+    $ python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import contextlib
+import datetime
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+from importlib import metadata
+
+import ooze
+import ooze.pool
+from benchmarks.bench_pool import contend
+
+GRAPHS = ((10, 3), (100, 5), (100, 25), (1000, 10), (1000, 50))
+"""The (providers, depth) of the synthetic graphs"""
+
+
+class Node:
+    def __init__(self, **dependencies):
+        self.dependencies = dependencies
+
+
+def synthetic_graph(container, providers, depth, fan_out=2):
+    """
+    Provide providers classes, spread over depth layers, to container.  Each class depends on
+    up to fan_out classes in the layer below it.  Returns the layers of class names.
+    """
+    layers = [[] for _ in range(depth)]
+    for index in range(providers):
+        layers[index % depth].append(f"node_{index}")
+    for level, names in enumerate(layers):
+        below = layers[level - 1] if level else []
+        for position, name in enumerate(names):
+            dependencies = [below[(position + offset) % len(below)] for offset in range(min(fan_out, len(below)))]
+            signature = inspect.Signature([inspect.Parameter(dependency, inspect.Parameter.KEYWORD_ONLY)
+                                           for dependency in dependencies])
+            container.provide(name)(type(name, (Node,), {'__signature__': signature}))
+    return layers
+
+
+def best(func, number, repeat=5):
+    """The best of repeat runs of func, in microseconds per call"""
+    func()
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1_000_000
+
+
+def bench_startup(providers, depth, repeat=5):
+    """run() on a graph that hasn't been instantiated yet"""
+    timings = []
+    for _ in range(repeat):
+        container = ooze.Container()
+        synthetic_graph(container, providers, depth)
+        started = timeit.default_timer()
+        container.run(lambda: None)
+        timings.append(timeit.default_timer() - started)
+    return min(timings) * 1_000_000
+
+
+def bench_resolve(providers, depth, number):
+    """resolve() of the class at the top of a graph that has been run"""
+    container = ooze.Container()
+    layers = synthetic_graph(container, providers, depth)
+    container.run(lambda: None)
+    top = layers[-1][0]
+    return best(lambda: container.resolve(top), number)
+
+
+def bench_magic(number):
+    """The per-call overhead of @ooze.magic injecting three dependencies, over calling the function directly"""
+    container = ooze.Container()
+    synthetic_graph(container, 10, 3)
+    container.run(lambda: None)
+
+    def route(request_id, node_0, node_1, node_9):
+        return request_id
+
+    with container:
+        injected = ooze.magic(route)
+        direct = best(lambda: route(1, None, None, None), number)
+        magic = best(lambda: injected(1), number)
+    return magic - direct
+
+
+@contextlib.contextmanager
+def settings(values):
+    """Point ooze at a temporary configuration file with the given values."""
+    previous = os.environ.get('APPLICATION_SETTINGS')
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'benchmark_settings.json')
+        with open(filename, 'w') as outfile:
+            json.dump(values, outfile)
+        os.environ['APPLICATION_SETTINGS'] = filename
+        ooze.reload_config()
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ['APPLICATION_SETTINGS']
+            else:
+                os.environ['APPLICATION_SETTINGS'] = previous
+            ooze.reload_config()
+
+
+def bench_fall_through(number):
+    """
+    resolve() of names found by each resolver in turn, ending with the configuration files.
+    The container forgets which resolver answered, and what it resolved, before every lookup,
+    so each one asks the resolvers in turn instead of going straight to the one it remembers.
+    """
+    container = ooze.Container()
+    synthetic_graph(container, 100, 5)
+    container.factory('request_id')(lambda: 42)
+    os.environ['BENCHMARK_REGION'] = 'eu-west-1'
+    ooze.reload_environment()
+    try:
+        with settings({'benchmark_timeout': 30}):
+            container.run(lambda: None)
+
+            def fall_through(dependency):
+                container._resolver_index.clear()
+                container._resolved.clear()
+                return container.resolve(dependency)
+
+            return {
+                name: best(lambda: fall_through(dependency), number)
+                for name, dependency in (('env', 'benchmark_region'), ('instance', 'node_0'),
+                                         ('factory', 'request_id'), ('config', 'benchmark_timeout'))
+            }
+    finally:
+        del os.environ['BENCHMARK_REGION']
+        ooze.reload_environment()
+
+
+def bench_pool(threads, borrows, max_size=None):
+    """The time per borrow and return with threads contending for 8 items"""
+    pool = ooze.pool.Pool(object, pool_size=8, max_size=max_size)
+    return 1_000_000 / contend(pool, threads=threads, borrows=borrows)
+
+
+def run_suite(quick=False):
+    """Run every benchmark and return the results, keyed by benchmark name"""
+    scale = 10 if quick else 1
+    results = {}
+    for providers, depth in GRAPHS:
+        graph = f"n={providers},depth={depth}"
+        results[f"startup[{graph}]"] = bench_startup(providers, depth, repeat=1 if quick else 5)
+        results[f"resolve[{graph}]"] = bench_resolve(providers, depth, 100_000 // scale)
+    results['magic.overhead'] = bench_magic(100_000 // scale)
+    for resolver, timing in bench_fall_through(100_000 // scale).items():
+        results[f"fall_through[{resolver}]"] = timing
+    for threads in (1, 8, 64):
+        results[f"pool[threads={threads}]"] = bench_pool(threads, 128_000 // threads // scale)
+        results[f"pool[threads={threads},max_size=8]"] = bench_pool(threads, 128_000 // threads // scale, max_size=8)
+    return results
+
+
+def environment():
+    """What the results were measured on"""
+    try:
+        version = metadata.version('ooze')
+    except metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'ooze': version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for checking the suite itself')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick)
+    for name, timing in results.items():
+        print(f"{name:>40}: {timing:12.3f} us")
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'environment': environment(), 'unit': 'us', 'results': results}, outfile, indent=2)
+            outfile.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
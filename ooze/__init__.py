@@ -1,20 +1,94 @@
 #!/usr/bin/env python
 """Ooze - A _very_ simple dependency injector"""
+import asyncio
+import collections
+import contextvars
 import functools
+import hashlib
 import inspect
+import json
 import os
+import sys
+import threading
+import time
+import typing
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+from ooze.profiling import DependencyProfile, InjectionEvent, Profiler, profile, profile_report
+
 
 class DependencyNotAvailable:
     """Indication that dependency isn't in the graph"""
 
 
-_STARTUP = DependencyNotAvailable
-_INSTANCES = {}
-_CLASSES_TO_INSTANTIATE = {}
-_FACTORIES = {}
+class _IntrospectionCache:
+    """
+    What was read from the signatures of classes and functions, without keeping them alive,
+    so those of containers that come and go, e.g. one per tenant or test, can be collected.
+    Keyed by id, with each entry dropped when its class or function is, since a
+    WeakKeyDictionary makes every lookup several times slower.  Callables that can't be
+    weakly referenced aren't cached.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key):
+        return self._values.get(id(key))
+
+    def __setitem__(self, key, value):
+        ident = id(key)
+        if ident not in self._values:
+            try:
+                finalizer = weakref.finalize(key, self._values.pop, ident, None)
+            except TypeError:
+                return
+            finalizer.atexit = False
+        self._values[ident] = value
+
+    def __len__(self):
+        return len(self._values)
+
+
+_GRAPH_VERSION = 0
+_PARAMETERS = _IntrospectionCache()
+_ANNOTATIONS = _IntrospectionCache()
+_TYPED_INJECTION = False
+_GRAPH_LOCK = threading.Lock()
+_SCOPE = contextvars.ContextVar('ooze_scope', default=None)
+_ACTIVE_CONTAINER = contextvars.ContextVar('ooze_container', default=None)
+# The tokens of the containers entered with a with statement, in a context var rather than on
+# each container so that overlapping asyncio tasks each exit the containers they entered
+_ENTERED = contextvars.ContextVar('ooze_entered', default=())
+_BUILDING = contextvars.ContextVar('ooze_building', default=None)
+_HOOKS = ()
+_LAZY_PATH = contextvars.ContextVar('ooze_lazy_path', default=())
+
+LAZY_PROVIDERS = False
+"""Whether provided classes are instantiated when first resolved rather than at startup"""
+
+CONFIG_CHECK_INTERVAL = 2.0
+"""Minimum number of seconds between checks for modified configuration files"""
+
+_CONFIG_INDEX = None
+_CONFIG_SIGNATURE = None
+_CONFIG_CHECKED_AT = 0.0
+
+_ENV_INDEX = None
+_ENV_PREFIX = None
+_ENV_TYPES = {}
+_ENV_TYPED = {}
 
 
 class InjectionError(Exception):
@@ -25,229 +99,1897 @@ class ConfigurationError(Exception):
     """Error related to reading configuration(s)"""
 
 
-def run(startup_callable=None):
-    """Look for a STARTUP callable and then run it the application by calling STARTUP."""
-    startup_to_run = startup_callable if startup_callable else _STARTUP
+class StartupError(InjectionError):
+    """One or more provided classes failed while being instantiated in parallel"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = ', '.join(f"{name} ({type(error).__name__}: {error})" for name, error in errors.items())
+        super().__init__(f"The following classes failed to instantiate: {details}")
+
+
+class Container:
+    """
+    A dependency graph.  The module level decorators and functions work on the current
+    container, which is the default one unless another has been made current with
+    `with container: ...`.  A child container sees everything in its parent, but what is
+    added to it stays in the child, so overriding a few items for a tenant or a test doesn't
+    copy or rebuild the rest of the graph.  Classes the parent has instantiated are shared.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        if parent is None:
+            self._instances = {}
+            self._factories = {}
+            self._scoped_factories = {}
+            self._factory_caches = {}
+        else:
+            self._instances = collections.ChainMap({}, parent._instances)
+            self._factories = collections.ChainMap({}, parent._factories)
+            self._scoped_factories = collections.ChainMap({}, parent._scoped_factories)
+            self._factory_caches = collections.ChainMap({}, parent._factory_caches)
+        self._startup = DependencyNotAvailable
+        self._classes_to_instantiate = {}
+        self._lazy_classes = {}
+        self._lazy_tasks = {}
+        self._build_locks = {}
+        self._build_task = None
+        self._classes = {}
+        self._per_process = set()
+        self._instantiation_order = []
+        self._manifest_plan = None
+        self._version = None
+        self._resolver_index = {}
+        self._resolved = {}
+        self._type_index = None
+        self._typed_parameters = {}
+        _CONTAINERS.add(self)
+
+    def __enter__(self):
+        _ENTERED.set(_ENTERED.get() + (_ACTIVE_CONTAINER.set(self),))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        entered = _ENTERED.get()
+        _ENTERED.set(entered[:-1])
+        _ACTIVE_CONTAINER.reset(entered[-1])
+
+    def child(self):
+        """A container that overrides this one"""
+        return Container(self)
+
+    def provide(self, name_or_item=None, *, lazy=None, per_process=False):
+        return _call_in(self, provide, name_or_item, lazy=lazy, per_process=per_process)
+
+    def provide_static(self, name: str, item):
+        return _call_in(self, provide_static, name, item)
+
+    def factory(self, name_or_item=None, *, scoped=False, teardown=None, cache=None):
+        return _call_in(self, factory, name_or_item, scoped=scoped, teardown=teardown, cache=cache)
+
+    def startup(self, func):
+        return _call_in(self, startup, func)
+
+    def run(self, startup_callable=None, parallel=None):
+        return _call_in(self, run, startup_callable, parallel)
+
+    async def run_async(self, startup_callable=None):
+        token = _ACTIVE_CONTAINER.set(self)
+        try:
+            return await run_async(startup_callable)
+        finally:
+            _ACTIVE_CONTAINER.reset(token)
+
+    def resolve(self, name):
+        return _call_in(self, resolve, name)
+
+    async def resolve_async(self, name):
+        token = _ACTIVE_CONTAINER.set(self)
+        try:
+            return await resolve_async(name)
+        finally:
+            _ACTIVE_CONTAINER.reset(token)
+
+    def magic(self, func):
+        """Like ooze.magic, but always injects from this container"""
+        wrapper = magic(func)
+
+        @functools.wraps(func)
+        def in_container(*args, **kwargs):
+            return _call_in(self, wrapper, *args, **kwargs)
+
+        return in_container
+
+    def instantiation_order(self):
+        return _call_in(self, instantiation_order)
+
+    def invalidate(self, name):
+        return _call_in(self, invalidate, name)
+
+    def cache_info(self, name):
+        return _call_in(self, cache_info, name)
+
+    def _forget(self):
+        """Drop what was learned about resolving names under an older graph version."""
+        self._resolver_index = {}
+        self._resolved = {}
+        self._type_index = None
+        self._typed_parameters = {}
+        self._version = _GRAPH_VERSION
+
+    def _lazy_owner(self, name):
+        """The container, this one or an ancestor, that name was provided to as a lazy class."""
+        container = self
+        while container is not None and name not in container._lazy_classes:
+            container = container.parent
+        return container
+
+    def _after_fork(self, stale):
+        """
+        Drop the instances of the stale classes, so they're instantiated again, lazily, in this
+        process.  Locks and builds that were in progress in the parent are forgotten too.
+        """
+        self._build_locks = {}
+        self._build_task = None
+        self._lazy_tasks = {}
+        own_instances = self._instances.maps[0] if self.parent is not None else self._instances
+        for name, cls in self._classes.items():
+            if name in stale and own_instances.pop(name, DependencyNotAvailable) is not DependencyNotAvailable:
+                self._lazy_classes[name] = cls
+        own_caches = self._factory_caches.maps[0] if self.parent is not None else self._factory_caches
+        for cache in own_caches.values():
+            cache._lock = threading.Lock()
+            cache.clear()
+
+    def _startup_callable(self):
+        container = self
+        while container._startup is DependencyNotAvailable and container.parent is not None:
+            container = container.parent
+        return container._startup
+
+
+_CONTAINERS = weakref.WeakSet()
+_DEFAULT_CONTAINER = Container()
+
+
+def _current():
+    """The container the module level functions work on."""
+    container = _ACTIVE_CONTAINER.get()
+    return _DEFAULT_CONTAINER if container is None else container
+
+
+def current_container():
+    """The container the module level decorators and functions currently use"""
+    return _current()
+
+
+def _call_in(container, func, *args, **kwargs):
+    """Call func with container as the current container."""
+    token = _ACTIVE_CONTAINER.set(container)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _ACTIVE_CONTAINER.reset(token)
+
+
+def run(startup_callable=None, parallel=None):
+    """
+    Look for a STARTUP callable and then run it the application by calling STARTUP.  When
+    parallel is given, up to that many independent classes are instantiated at the same time.
+    """
+    startup_to_run = startup_callable if startup_callable else _current()._startup_callable()
     if startup_to_run is DependencyNotAvailable:
         raise InjectionError("No startup function assigned")
-    _instantiate_objects()
-    return _execute(startup_to_run)
+    _instantiate_objects(parallel)
+    if _SCOPE.get() is not None:
+        return _execute(startup_to_run)
+    with scope():
+        return _execute(startup_to_run)
+
+
+async def run_async(startup_callable=None):
+    """Like run, but awaits async factories, async class initializers and an async STARTUP."""
+    startup_to_run = startup_callable if startup_callable else _current()._startup_callable()
+    if startup_to_run is DependencyNotAvailable:
+        raise InjectionError("No startup function assigned")
+    await _instantiate_objects_async()
+    if _SCOPE.get() is not None:
+        return await _execute_async(startup_to_run)
+    async with scope():
+        return await _execute_async(startup_to_run)
 
 
-def _instantiate_objects():
+def _instantiate_objects(parallel=None):
     """
     As the _provide_ decorators are encountered, if they are decorating classes, the classes
     are placed in an dictionary to be instantiated later.  This function instantiates those
-    classes right before the application STARTUP function is called.
+    classes right before the application STARTUP function is called.  Each class is
+    instantiated exactly once, after the classes it depends on.  With parallel, the classes
+    of each layer of the graph, which don't depend on each other, are instantiated on a
+    thread pool of that size.  A child container's parent is instantiated first.
+
+    Several threads may get here at once.  They share the work, each class being built by
+    whichever thread gets its lock first.
+    """
+    container = _current()
+    if container.parent is not None:
+        _call_in(container.parent, _instantiate_objects, parallel)
+    if not container._classes_to_instantiate:
+        return
+    failed = set()
+    graph, order = _build_plan()
+    if not parallel or parallel < 2:
+        # Classes that another thread is building, and the classes that need them, are left
+        # until everything else is built rather than waited for straight away
+        deferred = {}
+        for name in order:
+            if any(dep in failed for dep in graph[name]):
+                failed.add(name)
+            elif any(dep in deferred for dep in graph[name]) or not _build_class(name, failed, blocking=False):
+                deferred[name] = True
+        for name in deferred:
+            if any(dep in failed for dep in graph[name]):
+                failed.add(name)
+            else:
+                _build_class(name, failed)
+    else:
+        errors = {}
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='ooze') as executor:
+            for layer in _layers(graph):
+                futures = {}
+                for name in layer:
+                    if any(dep in failed for dep in graph[name]):
+                        failed.add(name)
+                        continue
+                    context = contextvars.copy_context()
+                    futures[name] = executor.submit(context.run, _build_class, name, failed)
+                for name, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as error:
+                        failed.add(name)
+                        errors[name] = error
+                if errors:
+                    raise StartupError(errors)
+    _check_instantiated()
+
+
+def _build_class(name, failed, blocking=True):
+    """
+    Instantiate a waiting class and move it into the graph, unless another thread already
+    has.  Returns False, without waiting, when another thread is building it and blocking is
+    False.  If the class can't get its dependencies, it's added to failed.
+    """
+    container = _current()
+    lock = _build_lock(container, name)
+    if not lock.acquire(blocking):
+        return False
+    try:
+        cls = container._classes_to_instantiate.get(name)
+        if cls is not None:
+            _add_instance(name, _execute(cls, name))
+    except InjectionError:
+        failed.add(name)
+    finally:
+        lock.release()
+    return True
+
+
+def _build_lock(container, name):
+    """The lock held while name is instantiated, so one slow class doesn't hold up the others."""
+    lock = container._build_locks.get(name)
+    if lock is None:
+        lock = container._build_locks.setdefault(name, threading.RLock())
+    return lock
+
+
+async def _instantiate_objects_async():
+    """
+    The async counterpart of _instantiate_objects.  Each layer of the graph is built
+    concurrently.  Tasks that get here while the graph is being built wait for that build.
     """
-    while True:
-        new_objs = []
-        for name in _CLASSES_TO_INSTANTIATE:
-            requested_class = _CLASSES_TO_INSTANTIATE[name]
+    container = _current()
+    if container.parent is not None:
+        token = _ACTIVE_CONTAINER.set(container.parent)
+        try:
+            await _instantiate_objects_async()
+        finally:
+            _ACTIVE_CONTAINER.reset(token)
+    if not container._classes_to_instantiate:
+        return
+    task = container._build_task
+    if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+        task = container._build_task = asyncio.ensure_future(_build_layers_async())
+    await asyncio.shield(task)
+
+
+async def _build_layers_async():
+    """Build the waiting classes of the current container, a layer at a time."""
+    classes = _current()._classes_to_instantiate
+    failed = set()
+    graph, _ = _build_plan()
+    for layer in _layers(graph):
+        buildable = [name for name in layer if not any(dep in failed for dep in graph[name])]
+        failed.update(name for name in layer if name not in buildable)
+        results = await asyncio.gather(*(_execute_async(classes[name], name) for name in buildable),
+                                       return_exceptions=True)
+        errors = {}
+        for name, result in zip(buildable, results):
+            if isinstance(result, InjectionError):
+                failed.add(name)
+            elif isinstance(result, Exception):
+                failed.add(name)
+                errors[name] = result
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                _add_instance(name, result)
+        if errors:
+            raise StartupError(errors)
+    _check_instantiated()
+
+
+def _add_instance(name, obj):
+    """Move an instantiated class into the graph"""
+    container = _current()
+    # Published as an instance before it stops waiting, so other threads always find it
+    container._instances[name.lower()] = obj
+    container._instantiation_order.append(name)
+    del container._classes_to_instantiate[name]
+
+
+def _check_instantiated():
+    names = list(_current()._classes_to_instantiate)
+    if names:
+        raise InjectionError(f"The following classes have missing dependencies: {', '.join(names)}")
+
+
+def _parameters(func):
+    """The names of the parameters that ooze injects into func, read from its signature only once."""
+    names = _PARAMETERS.get(func)
+    if names is None:
+        names = tuple(param.name for param in inspect.signature(func).parameters.values()
+                      if param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD))
+        _PARAMETERS[func] = names
+    return names
+
+
+def typed_injection(enabled=True):
+    """
+    Resolve parameters annotated with a class by the provider of that class, or of a subclass
+    of it, instead of by name.  A runtime checkable Protocol matches the providers of classes
+    that satisfy it.  Built-in types such as str and int, and annotations no provider
+    matches, are still resolved by name.
+    """
+    global _TYPED_INJECTION
+    _TYPED_INJECTION = enabled
+    graph_changed()
+
+
+def _annotations(func):
+    """The classes the parameters of func, and its result, are annotated with, read only once."""
+    hints = _ANNOTATIONS.get(func)
+    if hints is None:
+        target = func.__init__ if inspect.isclass(func) else func
+        try:
+            hints = typing.get_type_hints(target)
+        except Exception:
+            # e.g. forward references that can't be evaluated, which are left to resolve by name
+            hints = getattr(target, '__annotations__', {})
+        hints = {name: hint for name, hint in hints.items() if isinstance(hint, type) and not _builtin(hint)}
+        _ANNOTATIONS[func] = hints
+    return hints
+
+
+def _builtin(cls):
+    return cls.__module__ in ('builtins', 'typing')
+
+
+def _type_index(container):
+    """
+    Map every class the providers produce, and each of their base classes, to the names of
+    the providers that produce it.  Built when first needed after the graph changes.
+    """
+    index = container._type_index
+    if index is None:
+        index = {}
+        for name, produced in _produced_types(container).items():
+            for cls in inspect.getmro(produced):
+                if not _builtin(cls):
+                    index.setdefault(cls, []).append(name)
+        container._type_index = index
+    return index
+
+
+def _produced_types(container):
+    """The class of what each provided class, static item and annotated factory produces, keyed by name."""
+    lineage = []
+    while container is not None:
+        lineage.append(container)
+        container = container.parent
+    produced = {}
+    for ancestor in reversed(lineage):
+        own_factories = ancestor._factories.maps[0] if ancestor.parent is not None else ancestor._factories
+        own_instances = ancestor._instances.maps[0] if ancestor.parent is not None else ancestor._instances
+        for name, factory_func in own_factories.items():
+            if 'return' in _annotations(factory_func):
+                produced[name] = _annotations(factory_func)['return']
+        # Provided items are asked before factories, so they win when both have a name
+        for name, item in own_instances.items():
+            if not inspect.isfunction(item) and not inspect.isclass(item):
+                produced[name] = type(item)
+        produced.update(ancestor._classes)
+    return produced
+
+
+def _providers_of(container, cls):
+    """The names of the providers that produce a cls."""
+    index = _type_index(container)
+    names = index.get(cls)
+    if names is None:
+        names = []
+        if getattr(cls, '_is_runtime_protocol', False):
             try:
-                obj = _execute(requested_class)
-                _INSTANCES[name.lower()] = obj
-                new_objs.append(name)
-            except:
-                pass
-        if new_objs:
-            for name in new_objs:
-                del _CLASSES_TO_INSTANTIATE[name]
-        else:
-            break
-    if _CLASSES_TO_INSTANTIATE:
-        raise InjectionError(
-            f"The following classes have missing dependencies: {', '.join(_CLASSES_TO_INSTANTIATE.keys())}")
-
-
-def _execute(func):
-    """Figure out what the func needs to run and then run it."""
-    needed_args = inspect.signature(func)
-    kwargs = {key: _resolve_dependency(key) for key in needed_args.parameters}
-    missing_deps = [dep for dep in kwargs if kwargs[dep] is DependencyNotAvailable]
-    if missing_deps:
-        name = func.__name__
-        raise InjectionError(f"Cannot execute {name} - Missing dependencies: {', '.join(missing_deps)}")
-    return func(**kwargs)
-
-
-def _resolve_dependency(dep_name: str):
-    """Attempts to resolve the dependency"""
-    resolvers = [_resolve_dependency_os_env, _resolve_dependency_instance, _resolve_dependency_factory,
-                 _resolve_dependency_config]
-    dep = DependencyNotAvailable
-    for resolver in resolvers:
-        dep = resolver(dep_name)
+                names = list(dict.fromkeys(name for produced, providers in list(index.items())
+                                           if not getattr(produced, '_is_protocol', False)
+                                           and issubclass(produced, cls) for name in providers))
+            except TypeError:
+                # Protocols with data members can't be checked against classes, only subclassed
+                names = []
+        index[cls] = names
+    return names
+
+
+def _typed_parameters(func):
+    """
+    The parameters of func, each paired with the name of the provider the type index picked
+    for it, or None when it's resolved by name.  Worked out once per graph version.
+    """
+    container = _current()
+    if container._version != _GRAPH_VERSION:
+        container._forget()
+    pairs = container._typed_parameters.get(func)
+    if pairs is None:
+        hints = _annotations(func)
+        pairs = tuple((name, _typed_provider(container, name, hints[name]) if name in hints else None)
+                      for name in _parameters(func))
+        container._typed_parameters[func] = pairs
+    return pairs
+
+
+def _typed_provider(container, name, cls):
+    """The provider for a parameter annotated with cls.  Of several, the one with the parameter's name wins."""
+    providers = _providers_of(container, cls)
+    if len(providers) == 1:
+        return providers[0]
+    if name in providers:
+        return name
+    if providers:
+        raise InjectionError(f"{name}: {cls.__qualname__} is provided by each of {', '.join(providers)}")
+    return None
+
+
+def _injected(func):
+    """The parameters of func, each paired with the provider the type index picked for it, or None."""
+    if _TYPED_INJECTION:
+        return _typed_parameters(func)
+    return tuple((name, None) for name in _parameters(func))
+
+
+def _dependency_names(func):
+    """The names the dependencies of func are resolved by"""
+    return [provider or name for name, provider in _injected(func)]
+
+
+def _dependency_graph():
+    """Map each class waiting to be instantiated to the waiting classes it needs first."""
+    container = _current()
+    # A copy, since other threads may be instantiating these classes
+    classes = dict(container._classes_to_instantiate)
+    instances = container._instances
+    factories = container._factories
+    pending = {name.lower(): name for name in classes}
+    overriding = _preceding_resolvers(_resolve_dependency_instance)
+
+    def pending_dependencies(func, seen):
+        deps = []
+        for param, provider in _injected(func):
+            if provider:
+                # The provider the type index picked isn't overridden by the environment
+                param = provider
+            elif any(resolver(param) is not DependencyNotAvailable for resolver in overriding):
+                continue
+            if param in pending:
+                deps.append(pending[param])
+            elif param in instances or param in seen:
+                continue
+            elif container._lazy_owner(param) is not None:
+                # A lazy class is built on first use, so it needs what it depends on first
+                seen.add(param)
+                deps.extend(pending_dependencies(container._lazy_owner(param)._lazy_classes[param], seen))
+            elif param in factories:
+                seen.add(param)
+                deps.extend(pending_dependencies(factories[param], seen))
+        return deps
+
+    return {name: pending_dependencies(cls, set()) for name, cls in classes.items()}
+
+
+def _topological_order(graph):
+    """Order the graph so every name comes after its dependencies.  Cycles raise an InjectionError."""
+    order = []
+    done = set()
+    for root in graph:
+        if root in done:
+            continue
+        path = [root]
+        stack = [iter(graph[root])]
+        while stack:
+            for dep in stack[-1]:
+                if dep in done:
+                    continue
+                if dep in path:
+                    cycle = path[path.index(dep):] + [dep]
+                    raise InjectionError(f"Circular dependency: {' -> '.join(cycle)}")
+                path.append(dep)
+                stack.append(iter(graph[dep]))
+                break
+            else:
+                stack.pop()
+                name = path.pop()
+                done.add(name)
+                order.append(name)
+    return order
+
+
+def _layers(graph):
+    """Group the graph into layers.  Nothing in a layer depends on anything in the same or a later layer."""
+    depth = {}
+    layers = []
+    for name in _topological_order(graph):
+        depth[name] = max((depth[dep] + 1 for dep in graph[name]), default=0)
+        if depth[name] == len(layers):
+            layers.append([])
+        layers[depth[name]].append(name)
+    return layers
+
+
+def instantiation_order():
+    """The names of the provided classes in the order they were, or will be, instantiated."""
+    return _current()._instantiation_order + _build_plan()[1]
+
+
+def _build_plan():
+    """
+    The dependency graph of the classes waiting to be instantiated and the order to build
+    them in, taken from the loaded manifest when it was made for the same classes.
+    """
+    container = _current()
+    plan = container._manifest_plan
+    if plan is not None and plan[0].keys() == container._classes_to_instantiate.keys():
+        return plan
+    graph = _dependency_graph()
+    return graph, _topological_order(graph)
+
+
+MANIFEST_FILE = 'ooze_manifest.json'
+"""Where freeze writes, and load_manifest reads, the startup manifest by default"""
+
+
+def freeze(path=MANIFEST_FILE):
+    """
+    Check that everything in the current container can be resolved and write a manifest of
+    the parameters of every provided class and factory and the order the classes are built
+    in.  Loading it with load_manifest at startup skips working all of that out again.
+    """
+    container = _current()
+    graph = _dependency_graph()
+    order = _topological_order(graph)
+    callables = _manifest_callables(container)
+    missing = [f"{name} needs {param}" for name, func in callables.items()
+               for param in _dependency_names(func) if not _resolvable(container, param)]
+    if missing:
+        raise InjectionError(f"The following dependencies are missing: {', '.join(missing)}")
+    manifest = {
+        'fingerprint': _manifest_fingerprint(callables),
+        # By the name each is provided as, since lambdas and generated classes can share a qualified name
+        'parameters': {name: list(_parameters(func)) for name, func in callables.items()},
+        'graph': graph,
+        'order': order,
+        'overridden': _overridden_names(container),
+        'typed': _TYPED_INJECTION,
+    }
+    with open(path, 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    return manifest
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """
+    Use a manifest written by freeze for the current container.  When it's missing, or the
+    providers or their source files have changed since it was written, it's ignored and
+    False is returned.
+    """
+    container = _current()
+    try:
+        with open(path) as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        return False
+    callables = _manifest_callables(container)
+    if manifest.get('fingerprint') != _manifest_fingerprint(callables):
+        return False
+    parameters = manifest.get('parameters', {})
+    if parameters.keys() != callables.keys():
+        return False
+    for name, func in callables.items():
+        _PARAMETERS[func] = tuple(parameters[name])
+    # The environment decides which classes it overrides, so it can change the graph too
+    if manifest['overridden'] == _overridden_names(container) and manifest.get('typed', False) == _TYPED_INJECTION:
+        container._manifest_plan = (manifest['graph'], manifest['order'])
+    return True
+
+
+def _manifest_callables(container):
+    """Everything whose parameters go into the manifest, keyed by name."""
+    callables = {}
+    if container._startup is not DependencyNotAvailable:
+        callables['startup'] = container._startup
+    callables.update(container._factories)
+    callables.update(container._lazy_classes)
+    callables.update(container._classes_to_instantiate)
+    return callables
+
+
+def _qualified_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def _manifest_fingerprint(callables):
+    """Identify the providers by name and the files they are defined in by size and mtime."""
+    files = set()
+    for func in callables.values():
+        filename = getattr(sys.modules.get(func.__module__), '__file__', None)
+        if filename:
+            files.add(filename)
+    signature = [sorted((name, _qualified_name(func)) for name, func in callables.items())]
+    for filename in sorted(files):
+        try:
+            stat = os.stat(filename)
+            signature.append([filename, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            signature.append([filename, None])
+    return hashlib.sha256(json.dumps(signature).encode()).hexdigest()
+
+
+def _overridden_names(container):
+    """The classes and factories that resolvers asked before provided items answer for instead."""
+    overriding = _preceding_resolvers(_resolve_dependency_instance)
+    names = list(container._classes_to_instantiate) + list(container._factories)
+    return sorted(name for name in names if any(resolver(name) is not DependencyNotAvailable
+                                                for resolver in overriding))
+
+
+def _resolvable(container, name):
+    """Whether name can be resolved, without running any factories or building any classes."""
+    if name in container._instances or name in container._factories or container._lazy_owner(name):
+        return True
+    ancestor = container
+    while ancestor is not None:
+        if name in ancestor._classes_to_instantiate:
+            return True
+        ancestor = ancestor.parent
+    return any(resolver(name) is not DependencyNotAvailable for resolver in _RESOLVERS
+               if resolver not in (_resolve_dependency_instance, _resolve_dependency_factory))
+
+
+def _execute(func, name=None):
+    """Figure out what the func needs to run and then run it.  Given a name, the hooks are told about it."""
+    if name is not None and _HOOKS:
+        return _observed(name, 'build' if inspect.isclass(func) else 'factory', lambda: func(**_arguments(func)))
+    return func(**_arguments(func))
+
+
+def _arguments(func):
+    """Resolve everything func needs to run."""
+    if _TYPED_INJECTION:
+        return {key: _resolve_provider(provider) if provider else _resolve_dependency(key)
+                for key, provider in _typed_parameters(func)}
+    return {key: _resolve_dependency(key) for key in _parameters(func)}
+
+
+async def _execute_async(func, name=None):
+    """
+    Figure out what the func needs, await the dependencies that come from async factories
+    concurrently and then run it.  Awaitable results and async class initializers (an
+    `async def ainit(self)` method) are awaited too.
+    """
+    if name is not None and _HOOKS:
+        return await _observed_async(name, 'build' if inspect.isclass(func) else 'factory', _execute_async(func))
+    result = func(**await _arguments_async(func))
+    if inspect.isawaitable(result):
+        result = await result
+    if inspect.isclass(func) and inspect.iscoroutinefunction(getattr(result, 'ainit', None)):
+        await result.ainit()
+    return result
+
+
+async def _arguments_async(func):
+    """Resolve everything func needs to run, awaiting dependencies from async factories concurrently."""
+    kwargs = {}
+    pending = {}
+    try:
+        for key, provider in _injected(func):
+            dep = (_resolve_provider(provider, asynchronous=True) if provider
+                   else _resolve_dependency(key, asynchronous=True))
+            if isinstance(dep, _Awaiting):
+                pending[key] = dep.awaitable
+            else:
+                kwargs[key] = dep
+    except InjectionError:
+        for awaitable in pending.values():
+            awaitable.close()
+        raise
+    if len(pending) == 1:
+        key, awaitable = pending.popitem()
+        kwargs[key] = await awaitable
+    elif pending:
+        kwargs.update(zip(pending, await asyncio.gather(*pending.values())))
+    return kwargs
+
+
+class _Awaiting:
+    """A dependency that an async resolver still has to await"""
+
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+
+
+def _resolve_dependency(dep_name: str, asynchronous=False):
+    """
+    Attempts to resolve the dependency.  The resolver that satisfied a name is remembered so
+    later lookups go straight to it, until the graph changes.
+    """
+    container = _current()
+    if container._version != _GRAPH_VERSION:
+        container._forget()
+    index = container._resolver_index
+    owner = index.get(dep_name)
+    if owner is not None:
+        dep = (_ASYNC_VARIANTS.get(owner, owner) if asynchronous else owner)(dep_name)
+        if dep is not DependencyNotAvailable:
+            if _HOOKS:
+                _emit(InjectionEvent('resolve', dep_name, owner, None, _BUILDING.get(), None))
+            return dep
+    for resolver in _RESOLVERS:
+        dep = (_ASYNC_VARIANTS.get(resolver, resolver) if asynchronous else resolver)(dep_name)
+        if dep is not DependencyNotAvailable:
+            index[dep_name] = resolver
+            if _HOOKS:
+                _emit(InjectionEvent('resolve', dep_name, resolver, None, _BUILDING.get(), None))
+            return dep
+    raise InjectionError(f"{dep_name} not a valid dependency")
+
+
+def _resolve_provider(name, asynchronous=False):
+    """Resolve a provider the type index picked.  Only the provided items and factories are asked."""
+    for resolver in (_resolve_dependency_instance, _resolve_dependency_factory):
+        dep = (_ASYNC_VARIANTS[resolver] if asynchronous else resolver)(name)
         if dep is not DependencyNotAvailable:
-            break
+            if _HOOKS:
+                _emit(InjectionEvent('resolve', name, resolver, None, _BUILDING.get(), None))
+            return dep
+    raise InjectionError(f"{name} not a valid dependency")
+
+
+def _resolve_dependency_instance(dep_name: str):
+    container = _current()
+    dep = container._instances.get(dep_name, DependencyNotAvailable)
     if dep is DependencyNotAvailable:
-        raise InjectionError(f"{dep_name} not a valid dependency")
+        owner = container._lazy_owner(dep_name)
+        if owner is not None:
+            dep = _instantiate_lazy(owner, dep_name)
     return dep
 
 
-def _resolve_dependency_instance(dep_name: str):
-    return _INSTANCES.get(dep_name, DependencyNotAvailable)
+def _instantiate_lazy(container, name):
+    """
+    Instantiate a lazy class the first time it's needed, in the container it was provided to.
+    Only one thread ever builds it, and other lazy classes can be built at the same time.
+    """
+    path = _LAZY_PATH.get()
+    if name in path:
+        cycle = path[path.index(name):] + (name,)
+        raise InjectionError(f"Circular dependency: {' -> '.join(cycle)}")
+    with _build_lock(container, name):
+        dep = container._instances.get(name, DependencyNotAvailable)
+        if dep is not DependencyNotAvailable:
+            return dep
+        token = _LAZY_PATH.set(path + (name,))
+        try:
+            dep = _call_in(container, _execute, container._lazy_classes[name], name)
+        finally:
+            _LAZY_PATH.reset(token)
+        container._instances[name] = dep
+        return dep
 
 
 def _resolve_dependency_factory(dep_name: str):
-    factory_func = _FACTORIES.get(dep_name, DependencyNotAvailable)
+    factory_func = _current()._factories.get(dep_name, DependencyNotAvailable)
     if factory_func is DependencyNotAvailable:
         return factory_func
-    return _execute(factory_func)
+    return _call_factory(dep_name, factory_func)
 
 
-def _resolve_dependency_os_env(dep_name: str):
-    dep = os.environ.get(dep_name, DependencyNotAvailable)
-    if dep is DependencyNotAvailable:
-        dep = os.environ.get(dep_name.upper(), DependencyNotAvailable)
+def _call_factory(name, factory_func):
+    """Run a factory, or reuse what it produced earlier in the current scope if it's scoped."""
+    container = _current()
+    if name in container._factory_caches:
+        return _call_cached_factory(name, container._factory_caches[name], factory_func)
+    if name not in container._scoped_factories:
+        return _execute(factory_func, name)
+    current_scope = _SCOPE.get()
+    if current_scope is None:
+        raise InjectionError(f"{name} can only be resolved inside an ooze.scope()")
+    item = current_scope.items.get(name, DependencyNotAvailable)
+    if item is DependencyNotAvailable:
+        item = _execute(factory_func, name)
+        current_scope.add(name, item, container._scoped_factories[name])
+    return item
+
+
+def _call_cached_factory(name, cache, factory_func):
+    kwargs = _arguments(factory_func)
+    key = _cache_key(kwargs, factory_func)
+    result = cache.get(key)
+    if result is DependencyNotAvailable:
+        if _HOOKS:
+            result = _observed(name, 'factory', functools.partial(factory_func, **kwargs))
+        else:
+            result = factory_func(**kwargs)
+        cache.put(key, result)
+    return result
+
+
+def _cache_key(kwargs, func):
+    """
+    A factory cache key made from the values of the arguments func is called with.  Those that
+    can't be hashed, such as a dict, are keyed by identity when they're singletons, which are
+    injected as the same object every time.  Otherwise there's no key and the result isn't
+    cached, since each call would add an entry that's never used again.
+    """
+    key = tuple(kwargs.values())
+    try:
+        hash(key)
+    except TypeError:
+        singletons = _singleton_arguments(func)
+        if any(_unhashable(value) and name not in singletons for name, value in kwargs.items()):
+            return None
+        key = tuple(_Identity(value) if _unhashable(value) else value for value in key)
+    return key
+
+
+def _singleton_arguments(func):
+    """The parameters of func that are injected with provided items."""
+    container = _current()
+    return {param for param, provider in _injected(func)
+            if (provider in container._instances if provider
+                else container._resolver_index.get(param) is _resolve_dependency_instance)}
+
+
+def _unhashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return True
+    return False
+
+
+class _Identity:
+    """
+    An argument in a cache key that's equal only to itself, such as a dict of settings.  It
+    keeps the argument alive, so its id isn't reused while the key is in the cache.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and other.value is self.value
+
+
+def _resolve_dependency_instance_async(dep_name: str):
+    container = _current()
+    dep = container._instances.get(dep_name, DependencyNotAvailable)
     if dep is DependencyNotAvailable:
-        dep = os.environ.get(dep_name.lower(), DependencyNotAvailable)
+        owner = container._lazy_owner(dep_name)
+        if owner is not None:
+            dep = _Awaiting(_instantiate_lazy_async(owner, dep_name))
     return dep
 
 
+async def _instantiate_lazy_async(container, name):
+    """Instantiate a lazy class on the event loop.  Concurrent callers share one build."""
+    path = _LAZY_PATH.get()
+    if name in path:
+        cycle = path[path.index(name):] + (name,)
+        raise InjectionError(f"Circular dependency: {' -> '.join(cycle)}")
+    tasks = container._lazy_tasks
+    task = tasks.get(name)
+    if task is None:
+        _LAZY_PATH.set(path + (name,))
+        token = _ACTIVE_CONTAINER.set(container)
+        task = tasks[name] = asyncio.ensure_future(_execute_async(container._lazy_classes[name], name))
+        _ACTIVE_CONTAINER.reset(token)
+        _LAZY_PATH.set(path)
+        try:
+            dep = await task
+        finally:
+            del tasks[name]
+        container._instances[name] = dep
+        return dep
+    return await asyncio.shield(task)
+
+
+def _resolve_dependency_factory_async(dep_name: str):
+    factory_func = _current()._factories.get(dep_name, DependencyNotAvailable)
+    if factory_func is DependencyNotAvailable:
+        return factory_func
+    return _Awaiting(_call_factory_async(dep_name, factory_func))
+
+
+async def _call_factory_async(name, factory_func):
+    """The async counterpart of _call_factory.  Concurrent callers in a scope share one result."""
+    container = _current()
+    if name in container._factory_caches:
+        cache = container._factory_caches[name]
+        kwargs = await _arguments_async(factory_func)
+        key = _cache_key(kwargs, factory_func)
+        result = cache.get(key)
+        if result is DependencyNotAvailable:
+            result = await (_observed_async(name, 'factory', _call_async(factory_func, kwargs)) if _HOOKS
+                            else _call_async(factory_func, kwargs))
+            cache.put(key, result)
+        return result
+    if name not in container._scoped_factories:
+        return await _execute_async(factory_func, name)
+    current_scope = _SCOPE.get()
+    if current_scope is None:
+        raise InjectionError(f"{name} can only be resolved inside an ooze.scope()")
+    item = current_scope.items.get(name, DependencyNotAvailable)
+    if item is not DependencyNotAvailable:
+        return item
+    task = current_scope.pending.get(name)
+    if task is not None:
+        return await asyncio.shield(task)
+    task = current_scope.pending[name] = asyncio.ensure_future(_execute_async(factory_func, name))
+    try:
+        item = await task
+    finally:
+        del current_scope.pending[name]
+    current_scope.add(name, item, container._scoped_factories[name])
+    return item
+
+
+async def _call_async(func, kwargs):
+    result = func(**kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def _resolve_dependency_os_env(dep_name: str):
+    index = _ENV_INDEX if _ENV_INDEX is not None else _environment_index()
+    key = dep_name.lower()
+    dep = index.get(key, DependencyNotAvailable)
+    if dep is not DependencyNotAvailable and key in _ENV_TYPES:
+        return _typed_environment_value(key, dep)
+    return dep
+
+
+def _environment_index():
+    """
+    Take a snapshot of the environment variables, keyed by lower-cased name with the prefix
+    removed.  When two variables only differ by case, the upper-case one wins.
+    """
+    global _ENV_INDEX
+    prefix = (_ENV_PREFIX or '').upper()
+    index = {}
+    for key, value in os.environ.items():
+        if prefix:
+            if not key.upper().startswith(prefix):
+                continue
+            key = key[len(prefix):]
+        name = key.lower()
+        if name not in index or key.isupper():
+            index[name] = value
+    _ENV_TYPED.clear()
+    _ENV_INDEX = index
+    return index
+
+
+def _typed_environment_value(name, raw):
+    """Convert an environment variable to its configured type, converting each value only once."""
+    typed = _ENV_TYPED.get(name, DependencyNotAvailable)
+    if typed is not DependencyNotAvailable and typed[0] == raw:
+        return typed[1]
+    converter = _ENV_TYPES[name]
+    try:
+        if converter is bool:
+            value = _parse_bool(raw)
+        elif converter == 'json':
+            value = json.loads(raw)
+        else:
+            value = converter(raw)
+    except ValueError as error:
+        raise ConfigurationError(f"Environment variable for {name} is not a valid {converter}: {error}") from None
+    _ENV_TYPED[name] = (raw, value)
+    return value
+
+
+def _parse_bool(raw):
+    value = raw.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f"{raw!r} is not a boolean")
+
+
+def reload_environment():
+    """Take a fresh snapshot of the environment variables on the next lookup."""
+    global _ENV_INDEX
+    _ENV_INDEX = None
+    graph_changed()
+
+
+def configure_environment(prefix=None, types=None, first=True):
+    """
+    Configure how environment variables are injected.  With a prefix, only variables that
+    start with it are injected, under their name without the prefix.  types maps names to
+    int, float, bool, 'json' or any callable that converts the raw string.  When first is
+    False, provided items and factories take precedence over environment variables.
+    """
+    global _ENV_PREFIX, _ENV_TYPES
+    _ENV_PREFIX = prefix
+    _ENV_TYPES = {name.lower(): converter for name, converter in (types or {}).items()}
+    resolvers = [resolver for resolver in _RESOLVERS if resolver is not _resolve_dependency_os_env]
+    if first:
+        position = 0
+    elif _resolve_dependency_factory in resolvers:
+        position = resolvers.index(_resolve_dependency_factory) + 1
+    else:
+        position = len(resolvers)
+    resolvers.insert(position, _resolve_dependency_os_env)
+    set_resolvers(resolvers)
+    reload_environment()
+
+
 def _resolve_dependency_config(dep_name: str):
-    filenames = ['application_settings.json', 'application_settings.yml', 'application_settings.yaml']
+    index = _config_index()
+    dep = index.get(dep_name, DependencyNotAvailable)
+    if dep is DependencyNotAvailable and not dep_name.islower():
+        # As with environment variables, LOG_LEVEL finds log_level
+        dep = index.get(dep_name.lower(), DependencyNotAvailable)
+    return dep
+
+
+_RESOLVERS = (_resolve_dependency_os_env, _resolve_dependency_instance, _resolve_dependency_factory,
+              _resolve_dependency_config)
+_ASYNC_VARIANTS = {
+    _resolve_dependency_instance: _resolve_dependency_instance_async,
+    _resolve_dependency_factory: _resolve_dependency_factory_async,
+}
+_CACHEABLE_RESOLVERS = (_resolve_dependency_os_env, _resolve_dependency_instance)
+
+
+def resolvers():
+    """
+    The resolvers ooze asks for dependencies, in order.  By default, those are the environment
+    variable, provided item, factory and configuration file resolvers.
+    """
+    return list(_RESOLVERS)
+
+
+def set_resolvers(new_resolvers):
+    """
+    Replace the resolvers ooze asks for dependencies, in the order they should be asked.  A
+    resolver is a callable that takes a name and returns the dependency with that name or
+    DependencyNotAvailable.
+    """
+    global _RESOLVERS
+    new_resolvers = tuple(new_resolvers)
+    if not all(callable(resolver) for resolver in new_resolvers):
+        raise InjectionError('Resolvers must be callable')
+    _RESOLVERS = new_resolvers
+    graph_changed()
+
+
+def register_resolver(resolver, position=None):
+    """Add a resolver, after the existing ones unless a position in the list of resolvers is given."""
+    new_resolvers = resolvers()
+    new_resolvers.insert(len(new_resolvers) if position is None else position, resolver)
+    set_resolvers(new_resolvers)
+    return resolver
+
+
+def _preceding_resolvers(resolver):
+    """The resolvers that are asked before resolver, or all of them if it isn't in use."""
+    return _RESOLVERS[:_RESOLVERS.index(resolver)] if resolver in _RESOLVERS else _RESOLVERS
+
+
+def _config_filenames():
+    """
+    The configuration files to read, highest precedence first.  APPLICATION_SETTINGS can list
+    several files, separated by os.pathsep, each overriding the ones before it.
+    """
+    filenames = ['application_settings.json', 'application_settings.yml', 'application_settings.yaml',
+                 'application_settings.toml']
     if 'APPLICATION_SETTINGS' in os.environ:
-        filenames = [os.environ['APPLICATION_SETTINGS']] + filenames
+        layers = [filename for filename in os.environ['APPLICATION_SETTINGS'].split(os.pathsep) if filename]
+        filenames = layers[::-1] + filenames
+    return filenames
+
+
+def _config_signature(filenames):
+    """Identify the current version of each configuration file by its inode, size and mtime."""
+    signature = []
     for filename in filenames:
         try:
-            with open(filename) as infile:
-                extension = os.path.splitext(filename)[1]
-                if extension in ['.json', '.yml', '.yaml']:
-                    config = yaml.safe_load(infile)
-                else:
+            stat = os.stat(filename)
+            signature.append((filename, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append((filename, None))
+    return tuple(signature)
+
+
+def _load_config(filenames):
+    """
+    Parse every configuration file once and merge them, nested mappings key by key, into a
+    single index keyed by name.  Nested settings are indexed by their dotted path too, and
+    those from .env files by their lower-cased name too.
+    """
+    settings = {}
+    # The settings that came from .env files, by lower-cased name
+    dotenv = {}
+    for filename in reversed(filenames):
+        try:
+            with open(filename, encoding='utf-8') as infile:
+                # A file called .env has no extension, it's all name
+                extension = (os.path.splitext(filename)[1] or os.path.basename(filename)).lower()
+                parser = _CONFIG_PARSERS.get(extension)
+                if parser is None:
                     raise ConfigurationError(f"Configuration files with {extension} extension not supported")
-                if dep_name in config:
-                    return config[dep_name]
+                config = parser(infile)
         except FileNotFoundError:
-            pass
-    return DependencyNotAvailable
+            continue
+        if config is None:
+            continue
+        if not isinstance(config, dict):
+            raise ConfigurationError(f"Configuration file {filename} must contain a mapping")
+        _replace_dotenv_keys(settings, config, dotenv, extension == '.env')
+        _merge_settings(settings, config)
+    index = _flatten_settings(settings)
+    for folded, key in dotenv.items():
+        index.setdefault(folded, index[key])
+    return index
+
+
+def _replace_dotenv_keys(settings, layer, dotenv, from_dotenv):
+    """
+    Drop the settings that the keys of layer override in another case.  Keys from .env files
+    match settings in any case, as environment variables do, so LOG_LEVEL in a .env file
+    overrides log_level from the files before it, and log_level overrides LOG_LEVEL from one.
+    """
+    for key in layer:
+        folded = key.lower()
+        if from_dotenv:
+            for existing in [name for name in settings if name != key and name.lower() == folded]:
+                del settings[existing]
+            dotenv[folded] = key
+        else:
+            existing = dotenv.pop(folded, None)
+            if existing is not None and existing != key:
+                del settings[existing]
+
+
+def _merge_settings(settings, layer):
+    """Merge a configuration file into the settings read so far.  Mappings are merged, everything else replaced."""
+    for key, value in layer.items():
+        if isinstance(value, dict) and isinstance(settings.get(key), dict):
+            settings[key] = _merge_settings(dict(settings[key]), value)
+        else:
+            settings[key] = value
+    return settings
+
+
+def _flatten_settings(settings):
+    """Index the settings by name, and every nested setting by its dotted path, e.g. database.host."""
+    index = dict(settings)
+    nested = [(f"{key}.", value) for key, value in settings.items() if isinstance(value, dict)]
+    while nested:
+        prefix, mapping = nested.pop()
+        for key, value in mapping.items():
+            index.setdefault(f"{prefix}{key}", value)
+            if isinstance(value, dict):
+                nested.append((f"{prefix}{key}.", value))
+    return index
+
+
+def _parse_json(infile):
+    return json.load(infile)
+
+
+def _parse_yaml(infile):
+    # The LibYAML loader is many times faster, when PyYAML was built with it
+    return yaml.load(infile, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _parse_toml(infile):
+    if tomllib is None:
+        raise ConfigurationError("TOML configuration files need Python 3.11 or the tomli package")
+    return tomllib.loads(infile.read())
+
+
+def _parse_dotenv(infile):
+    """
+    KEY=value lines, as in a .env file.  Blank lines, comments and a leading `export` are
+    skipped, and quotes around values are removed.  Keys are kept as written, and matched in
+    any case when the files are merged and looked up, as environment variables are.
+    """
+    settings = {}
+    for number, line in enumerate(infile, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('export '):
+            line = line[len('export '):].lstrip()
+        key, separator, value = line.partition('=')
+        if not separator:
+            raise ConfigurationError(f"Line {number} of {infile.name} isn't KEY=value")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        settings[key.strip()] = value
+    return settings
+
+
+_CONFIG_PARSERS = {
+    '.json': _parse_json,
+    '.yml': _parse_yaml,
+    '.yaml': _parse_yaml,
+    '.toml': _parse_toml,
+    '.env': _parse_dotenv,
+}
+
+
+def register_config_parser(extension, parser):
+    """
+    Read configuration files with the given extension, e.g. '.ini', with parser.  It's given
+    the open file and returns a mapping of settings.
+    """
+    _CONFIG_PARSERS[extension.lower()] = parser
+    reload_config()
+
+
+def _config_index():
+    """
+    Return the parsed configuration index.  The files are only re-read when one of them has been
+    created, replaced or modified, and that is checked at most every CONFIG_CHECK_INTERVAL seconds.
+    """
+    global _CONFIG_INDEX, _CONFIG_SIGNATURE, _CONFIG_CHECKED_AT
+    now = time.monotonic()
+    if _CONFIG_INDEX is not None and now - _CONFIG_CHECKED_AT < CONFIG_CHECK_INTERVAL:
+        return _CONFIG_INDEX
+    filenames = _config_filenames()
+    signature = _config_signature(filenames)
+    if _CONFIG_INDEX is None or signature != _CONFIG_SIGNATURE:
+        _CONFIG_INDEX = _load_config(filenames)
+        _CONFIG_SIGNATURE = signature
+        graph_changed()
+    _CONFIG_CHECKED_AT = now
+    return _CONFIG_INDEX
+
+
+def reload_config():
+    """Discard the cached configuration so the settings files are read again on the next lookup."""
+    global _CONFIG_INDEX, _CONFIG_SIGNATURE
+    _CONFIG_INDEX = None
+    _CONFIG_SIGNATURE = None
+    graph_changed()
+
+
+def graph_changed():
+    """
+    Record that the dependency graph, or something a resolver reads from, has changed so that
+    anything compiled or cached against it gets rebuilt.  Custom resolvers should call this
+    when the values they provide change.
+    """
+    global _GRAPH_VERSION
+    with _GRAPH_LOCK:
+        _GRAPH_VERSION += 1
+
+
+def _after_fork_in_child():
+    """
+    Rebuild, in a forked child process, the per_process classes and every class that was
+    given one of them.  Everything else the parent built is still shared.
+    """
+    global _GRAPH_LOCK
+    _GRAPH_LOCK = threading.Lock()
+    containers = list(_CONTAINERS)
+    stale = set()
+    for container in containers:
+        stale.update(container._per_process)
+    changed = bool(stale)
+    while changed:
+        changed = False
+        for container in containers:
+            for name, cls in container._classes.items():
+                if name not in stale and any(param in stale for param in _call_in(container, _dependency_names, cls)):
+                    stale.add(name)
+                    changed = True
+    for container in containers:
+        container._after_fork(stale)
+    graph_changed()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 def startup(func):
     """A decorator that marks what the startup function should be in the app."""
-    global _STARTUP
     if not callable(func):
         raise InjectionError('Startup must be callable')
-    _STARTUP = func
+    _current()._startup = func
     return func
 
 
-def provide(name_or_item):
-    """ A decorator to add a class, function or static value to the dependency graph."""
+def provide(name_or_item=None, *, lazy=None, per_process=False):
+    """
+    A decorator to add a class, function or static value to the dependency graph.  Lazy
+    classes are only instantiated the first time they are resolved.  When lazy isn't given,
+    LAZY_PROVIDERS decides.  A per_process class gets a new instance, created when it's first
+    needed, in each process forked after it was instantiated.
+    """
+    if lazy is None:
+        lazy = LAZY_PROVIDERS
+    container = _current()
     if inspect.isclass(name_or_item):
         class_to_provide = name_or_item
         class_name = class_to_provide.__name__.lower()
-        _CLASSES_TO_INSTANTIATE[class_name] = class_to_provide
+        _provide_class(container, class_name, class_to_provide, lazy, per_process)
         return class_to_provide
+    elif per_process and name_or_item is not None and not isinstance(name_or_item, str):
+        raise InjectionError("Only classes can be provided per process")
     elif inspect.isfunction(name_or_item):
         func_to_provide = name_or_item
         func_name = name_or_item.__name__.lower()
-        _INSTANCES[func_name] = func_to_provide
+        container._instances[func_name] = func_to_provide
+        graph_changed()
         return func_to_provide
     else:
         @functools.wraps(name_or_item)
         def inner_provide(item):
-            name = name_or_item.lower()
+            name = name_or_item.lower() if name_or_item is not None else item.__name__.lower()
             if inspect.isclass(item):
-                _CLASSES_TO_INSTANTIATE[name] = item
+                _provide_class(container, name, item, lazy, per_process)
+            elif per_process:
+                raise InjectionError("Only classes can be provided per process")
             else:
-                _INSTANCES[name] = item
+                container._instances[name] = item
+                graph_changed()
             return item
 
         return inner_provide
 
 
+def _provide_class(container, name, cls, lazy, per_process):
+    container._classes[name] = cls
+    if per_process:
+        container._per_process.add(name)
+    else:
+        container._per_process.discard(name)
+    if lazy:
+        container._instances.pop(name, None)
+        container._lazy_classes[name] = cls
+    else:
+        container._lazy_classes.pop(name, None)
+        container._classes_to_instantiate[name] = cls
+    container._manifest_plan = None
+    graph_changed()
+
+
 def provide_static(name: str, item):
     """Convenience method to add static values"""
     provide(name)(item)
 
 
-def factory(name_or_item):
-    """A decorator to add a factory to the dependency graph."""
+def factory(name_or_item=None, *, scoped=False, teardown=None, cache=None):
+    """
+    A decorator to add a factory to the dependency graph.  A scoped factory runs once per
+    ooze.scope() and its result is torn down, by calling teardown, when the scope exits.
+    A factory with a cache (True or a FactoryCache) only runs again when its arguments
+    change or its cached result expires.
+    """
+    if teardown is not None and not scoped:
+        raise InjectionError("Only scoped factories can have a teardown")
+    if cache is not None and scoped:
+        raise InjectionError("Scoped factories cannot be cached")
+    container = _current()
     if callable(name_or_item):
         factory_func = name_or_item
         factory_name = factory_func.__name__.lower()
-        _FACTORIES[factory_name] = factory_func
+        _add_factory(container, factory_name, factory_func, scoped, teardown, cache)
         return factory_func
     else:
         @functools.wraps(name_or_item)
         def inner_factory(item):
             inner_factory_func = item
-            inner_factory_name = name_or_item
-            _FACTORIES[inner_factory_name] = inner_factory_func
+            inner_factory_name = name_or_item if name_or_item is not None else item.__name__.lower()
+            _add_factory(container, inner_factory_name, inner_factory_func, scoped, teardown, cache)
             return inner_factory_func
 
         return inner_factory
 
 
+def _add_factory(container, name, factory_func, scoped, teardown, cache):
+    container._factories[name] = factory_func
+    container._manifest_plan = None
+    if scoped:
+        container._scoped_factories[name] = teardown
+    else:
+        container._scoped_factories.pop(name, None)
+    if cache is True:
+        cache = FactoryCache()
+    if cache:
+        container._factory_caches[name] = cache
+    else:
+        container._factory_caches.pop(name, None)
+    graph_changed()
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class FactoryCache:
+    """
+    Remembers a factory's results, keyed by the values of its arguments.  Results expire after
+    ttl seconds and, when maxsize is given, the least recently used results are dropped to make
+    room.  Without either, each result is kept until it's invalidated.
+    """
+
+    def __init__(self, ttl: float = None, maxsize: int = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        # (expires, key) in the order the results were put, so expired ones are dropped oldest first
+        self._expiries = collections.deque()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached result for key or DependencyNotAvailable.  There's never a result for a key of None."""
+        with self._lock:
+            entry = self._results.get(key) if key is not None else None
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._expire()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return DependencyNotAvailable
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        if key is None:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._results[key] = (result, expires)
+            self._results.move_to_end(key)
+            if expires is not None:
+                self._expiries.append((expires, key))
+                self._expire()
+            if self.maxsize is not None and len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def _expire(self):
+        """Drop the results that have expired.  Call with the lock held."""
+        now = time.monotonic()
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expires, key = expiries.popleft()
+            entry = self._results.get(key)
+            # Unless it was put again since
+            if entry is not None and entry[1] == expires:
+                del self._results[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._expiries.clear()
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
+
+
+def invalidate(name):
+    """Forget the cached results of a factory so it runs again the next time it's needed."""
+    cache = _current()._factory_caches.get(name)
+    if cache is None:
+        raise InjectionError(f"{name} is not a cached factory")
+    cache.clear()
+
+
+def cache_info(name):
+    """The hits, misses, maxsize and current size of a cached factory."""
+    cache = _current()._factory_caches.get(name)
+    if cache is None:
+        raise InjectionError(f"{name} is not a cached factory")
+    return cache.info()
+
+
+def add_hook(hook):
+    """Call hook with an InjectionEvent whenever a dependency is resolved, built or fails to build."""
+    global _HOOKS
+    _HOOKS = _HOOKS + (hook,)
+    return hook
+
+
+def remove_hook(hook):
+    global _HOOKS
+    _HOOKS = tuple(existing for existing in _HOOKS if existing is not hook)
+
+
+def _emit(event):
+    for hook in _HOOKS:
+        hook(event)
+
+
+def _observed(name, kind, call):
+    """Run call and tell the hooks how long it took.  What it resolves is recorded as needed by name."""
+    parent = _BUILDING.get()
+    token = _BUILDING.set(name)
+    start = time.perf_counter()
+    try:
+        result = call()
+    except Exception as error:
+        _emit(InjectionEvent('failure', name, None, time.perf_counter() - start, parent, error))
+        raise
+    finally:
+        _BUILDING.reset(token)
+    _emit(InjectionEvent(kind, name, None, time.perf_counter() - start, parent, None))
+    return result
+
+
+async def _observed_async(name, kind, awaitable):
+    """The async counterpart of _observed."""
+    parent = _BUILDING.get()
+    token = _BUILDING.set(name)
+    start = time.perf_counter()
+    try:
+        result = await awaitable
+    except Exception as error:
+        _emit(InjectionEvent('failure', name, None, time.perf_counter() - start, parent, error))
+        raise
+    finally:
+        _BUILDING.reset(token)
+    _emit(InjectionEvent(kind, name, None, time.perf_counter() - start, parent, None))
+    return result
+
+
+class Scope:
+    """
+    A context manager for a unit of work, such as a web request.  Scoped factories run once
+    per scope and everything they created is torn down when the scope exits.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.pending = {}
+        self._teardowns = []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _SCOPE.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _SCOPE.reset(self._token)
+        self.close()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        _SCOPE.reset(self._token)
+        await self.aclose()
+
+    def add(self, name, item, teardown=None):
+        self.items[name] = item
+        if teardown is not None:
+            self._teardowns.append((teardown, item))
+
+    def close(self):
+        """Tear down everything created in this scope, newest first."""
+        errors = []
+        while self._teardowns:
+            teardown, item = self._teardowns.pop()
+            try:
+                teardown(item)
+            except Exception as error:
+                errors.append(error)
+        self.items = {}
+        if errors:
+            raise errors[0]
+
+    async def aclose(self):
+        """Like close, but awaits teardowns that are coroutines."""
+        errors = []
+        while self._teardowns:
+            teardown, item = self._teardowns.pop()
+            try:
+                result = teardown(item)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as error:
+                errors.append(error)
+        self.items = {}
+        if errors:
+            raise errors[0]
+
+
+def scope():
+    """Start a new scope for scoped factories, e.g. `with ooze.scope(): ...`"""
+    return Scope()
+
+
 def resolve(name):
     """Retrieve an item from the dependency graph from outside a provided callable"""
+    container = _current()
+    version = _GRAPH_VERSION
+    if container._version == version:
+        dep = container._resolved.get(name, DependencyNotAvailable)
+        if dep is not DependencyNotAvailable:
+            return dep
     _instantiate_objects()
-    return _resolve_dependency(name)
+    dep = _resolve_dependency(name)
+    # Singletons and environment variables only change along with the graph version, so
+    # they can be cached until it changes.  Factories must run every time.
+    if version == _GRAPH_VERSION and container._resolver_index.get(name) in _CACHEABLE_RESOLVERS:
+        container._resolved[name] = dep
+    return dep
+
+
+async def resolve_async(name):
+    """Retrieve an item from the dependency graph, awaiting async factories and initializers"""
+    container = _current()
+    version = _GRAPH_VERSION
+    if container._version == version:
+        dep = container._resolved.get(name, DependencyNotAvailable)
+        if dep is not DependencyNotAvailable:
+            return dep
+    await _instantiate_objects_async()
+    dep = _resolve_dependency(name, asynchronous=True)
+    if isinstance(dep, _Awaiting):
+        dep = await dep.awaitable
+    if version == _GRAPH_VERSION and container._resolver_index.get(name) in _CACHEABLE_RESOLVERS:
+        container._resolved[name] = dep
+    return dep
+
+
+class _InjectionPlan:
+    """
+    What a magic function needs injected, worked out once instead of on every call.  The
+    resolvers for the parameters are bound against the current container and are rebound
+    whenever the graph changes or the function is called in another container.  Given
+    names, only those parameters are injected.
+    """
+
+    def __init__(self, func, names=None):
+        parameters = [param for param in inspect.signature(func).parameters.values()
+                      if param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD)
+                      and (names is None or param.name in names)]
+        self.func = func
+        self.names = tuple(param.name for param in parameters)
+        self.positional_only = len([param for param in parameters if param.kind == param.POSITIONAL_ONLY])
+        self.resolvers = {}
+        self.container = None
+        self.version = None
+
+    def bind(self, container):
+        _instantiate_objects()
+        providers = dict(_typed_parameters(self.func)) if _TYPED_INJECTION else {}
+        self.resolvers = {name: _bind_provider(container, providers[name]) if providers.get(name)
+                          else _bind_resolver(container, name) for name in self.names}
+        self.container = container
+        self.version = _GRAPH_VERSION
+
+    def arguments(self, args, kwargs):
+        """Fill in the arguments the caller didn't supply."""
+        container = _current()
+        if self.version != _GRAPH_VERSION or self.container is not container:
+            self.bind(container)
+        resolvers = self.resolvers
+        for name in self.names[len(args):self.positional_only]:
+            args += (resolvers[name](),)
+        for name in self.names[len(args):]:
+            if name not in kwargs:
+                kwargs[name] = resolvers[name]()
+        return args, kwargs
+
+
+def _bind_resolver(container, name):
+    """
+    Return a callable that resolves name.  Provided items and factories are looked up once
+    here.  Resolvers that come before them, such as the environment, are still asked first,
+    as in _resolve_dependency.
+    """
+    instance = container._instances.get(name, DependencyNotAvailable)
+    if instance is not DependencyNotAvailable and _resolve_dependency_instance in _RESOLVERS:
+        return _bind_after(name, _preceding_resolvers(_resolve_dependency_instance), lambda: instance)
+    factory_func = container._factories.get(name, DependencyNotAvailable)
+    if factory_func is not DependencyNotAvailable and _resolve_dependency_factory in _RESOLVERS:
+        earlier = [resolver for resolver in _preceding_resolvers(_resolve_dependency_factory)
+                   if resolver is not _resolve_dependency_instance]
+        return _bind_after(name, earlier, functools.partial(_call_factory, name, factory_func))
+    return functools.partial(_resolve_dependency, name)
+
+
+def _bind_provider(container, name):
+    """Return a callable that resolves a provider the type index picked."""
+    instance = container._instances.get(name, DependencyNotAvailable)
+    if instance is not DependencyNotAvailable:
+        return lambda: instance
+    return functools.partial(_resolve_provider, name)
+
+
+def _bind_after(name, earlier, bound):
+    earlier = list(earlier)
+    # The environment snapshot only changes along with the graph version, so it's asked once, now
+    while earlier and earlier[0] in _CACHEABLE_RESOLVERS:
+        dep = earlier.pop(0)(name)
+        if dep is not DependencyNotAvailable:
+            return lambda: dep
+    if not earlier:
+        return bound
+
+    def resolve_bound():
+        for resolver in earlier:
+            dep = resolver(name)
+            if dep is not DependencyNotAvailable:
+                return dep
+        return bound()
+
+    return resolve_bound
 
 
 def magic(func):
-    """Decorator that injects any parameters that aren't given by the non-ooze caller."""
+    """
+    Decorator that injects any parameters that aren't given by the non-ooze caller.  When
+    there are scoped factories and no scope is active, each call gets a scope of its own.
+    For coroutine and generator functions, it lasts until they finish, not until they return
+    a coroutine or generator.
+    """
+    plan = None
+
+    def arguments(args, kwargs):
+        nonlocal plan
+        if plan is None:
+            plan = _InjectionPlan(func)
+        if len(plan.names) <= len(args) + len(kwargs):
+            return args, kwargs
+        return plan.arguments(args, kwargs)
+
+    def own_scope():
+        return bool(_current()._scoped_factories) and _SCOPE.get() is None
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if own_scope():
+                async with scope():
+                    args, kwargs = arguments(args, kwargs)
+                    return await func(*args, **kwargs)
+            args, kwargs = arguments(args, kwargs)
+            return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def async_generator_wrapper(*args, **kwargs):
+            if own_scope():
+                async with scope():
+                    args, kwargs = arguments(args, kwargs)
+                    async for item in func(*args, **kwargs):
+                        yield item
+                return
+            args, kwargs = arguments(args, kwargs)
+            async for item in func(*args, **kwargs):
+                yield item
+
+        return async_generator_wrapper
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            if own_scope():
+                with scope():
+                    args, kwargs = arguments(args, kwargs)
+                    return (yield from func(*args, **kwargs))
+            args, kwargs = arguments(args, kwargs)
+            return (yield from func(*args, **kwargs))
+
+        return generator_wrapper
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        needed_args = inspect.signature(func)
-        if len(needed_args.parameters) <= len(args) + len(kwargs):
-            return func(*args, **kwargs)
-        ooze_kwargs = {}
-        for idx, key in enumerate(needed_args.parameters.keys()):
-            if idx < len(args):
-                ooze_kwargs[key] = args[idx]
-            elif key in kwargs:
-                ooze_kwargs[key] = kwargs[key]
-            else:
-                ooze_kwargs[key] = resolve(key)
-        return func(*[], **ooze_kwargs)
+        if own_scope():
+            with scope():
+                args, kwargs = arguments(args, kwargs)
+                return func(*args, **kwargs)
+        args, kwargs = arguments(args, kwargs)
+        return func(*args, **kwargs)
 
     return wrapper
 
 
 def magic_dependable(func):
-    """A decorator that bridges a FastAPI Dependable with Ooze"""
-
-    def get_args():
-        needed_args = inspect.signature(func)
-        kwargs = {}
-        for idx, key in enumerate(needed_args.parameters.keys()):
-            kwargs[key] = resolve(key)
-        return kwargs
+    """
+    A decorator that bridges a FastAPI Dependable with Ooze.  ooze.fastapi.injectable does the
+    same, but lets FastAPI see and cache the dependencies.
+    """
 
     def wrapper():
-        ooze_kwargs = get_args()
-        return func(**ooze_kwargs)
+        return func(**{key: resolve(key) for key in _parameters(func)})
 
     async def async_wrapper():
-        ooze_kwargs = get_args()
-
-        return await func(**ooze_kwargs)
+        await _instantiate_objects_async()
+        return await _execute_async(func)
 
     return async_wrapper if inspect.iscoroutinefunction(func) else wrapper
 
 
 class OozeBottlePlugin:
+    """
+    Injects ooze dependencies into Bottle routes.  Which of a route's arguments ooze provides
+    is worked out when the route is installed, and each request is served from the container
+    that was current then.  Singletons are bound once, and factories, scoped factories,
+    environment variables and configuration are resolved on each request.  Arguments ooze
+    doesn't know are left to Bottle and other plugins.
+    """
     api = 2
 
     def apply(self, callback, _):
-        args = inspect.signature(callback)
-        dependencies = {}
-
-        for kw in args.parameters:
-            try:
-                dependencies[kw] = resolve(kw)
-            except InjectionError:
-                # Ignore injection error because other Bottle plugins may satisfy
-                pass
-        if not dependencies:
+        container = _current()
+        names = [name for name, provider in _injected(callback) if _resolvable(container, provider or name)]
+        if not names:
             return callback
+        plan = _InjectionPlan(callback, names)
+        # Scoped dependencies are created per request
+        scoped = any(name in container._scoped_factories for name in names)
+
+        def serve(*args, **kwargs):
+            if not scoped or _SCOPE.get() is not None:
+                args, kwargs = plan.arguments(args, kwargs)
+                return callback(*args, **kwargs)
+            with scope():
+                args, kwargs = plan.arguments(args, kwargs)
+                return callback(*args, **kwargs)
 
         def wrapper(*args, **kwargs):
-            kwargs = kwargs | dependencies
-            return callback(*args, **kwargs)
+            return _call_in(container, serve, *args, **kwargs)
 
         return wrapper
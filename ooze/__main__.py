@@ -0,0 +1,34 @@
+"""
+Command line tools for ooze.
+
+    $ python -m ooze freeze myapp.main [other.modules ...] [--output ooze_manifest.json]
+"""
+import argparse
+import importlib
+import sys
+
+import ooze
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ooze')
+    commands = parser.add_subparsers(dest='command', required=True)
+    freeze = commands.add_parser('freeze', help='check the dependency graph and write a startup manifest')
+    freeze.add_argument('modules', nargs='+', help='modules to import so their providers are registered')
+    freeze.add_argument('-o', '--output', default=ooze.MANIFEST_FILE, help='where to write the manifest')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, '')
+    for module in args.modules:
+        importlib.import_module(module)
+    try:
+        manifest = ooze.freeze(args.output)
+    except ooze.InjectionError as error:
+        print(f"ooze: {error}", file=sys.stderr)
+        return 1
+    print(f"Wrote {args.output}: {len(manifest['parameters'])} providers, {len(manifest['order'])} classes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+FastAPI dependencies generated from the ooze graph.
+
+    from fastapi import FastAPI
+    from ooze.fastapi import depends
+
+    app = FastAPI()
+
+    @app.get('/orders')
+    async def list_orders(repository=depends('orderrepository')):
+        return await repository.get_orders()
+
+Provided items, environment variables and settings become async dependencies that return
+what ooze resolves, so FastAPI doesn't hand them to its threadpool.  A factory becomes a
+dependency with the factory's parameters, each of them depending in turn on what ooze
+would inject, so FastAPI resolves the whole tree itself.  It resolves shared
+sub-dependencies once per request and runs factories that aren't async in its threadpool.
+"""
+import inspect
+import threading
+import weakref
+
+from fastapi import Depends
+
+import ooze
+
+_DEPENDENCIES = weakref.WeakKeyDictionary()
+_LOCK = threading.RLock()
+
+
+def depends(name):
+    """A FastAPI Depends() for the ooze dependency with the given name"""
+    return Depends(dependency(name))
+
+
+def dependency(name):
+    """
+    The FastAPI dependency for the ooze dependency with the given name in the current
+    container.  It's generated the first time it's asked for and reused until what it was
+    generated from is replaced, so FastAPI recognises it as the same dependency wherever it's
+    used.
+    """
+    return _dependency(ooze.current_container(), name, ())
+
+
+def injectable(func):
+    """
+    A decorator that turns a function or class into a FastAPI dependency.  The parameters
+    ooze provides depend on the ooze dependencies, and the others are left for FastAPI to
+    fill in from the request.  Unlike ooze.magic_dependable, FastAPI sees the whole tree.
+    """
+    container = ooze.current_container()
+    providers = _providers(container, func)
+    parameters = []
+    for param in inspect.signature(func).parameters.values():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        # Keyword only, since the dependencies now have defaults and the request parameters may not
+        param = param.replace(kind=param.KEYWORD_ONLY)
+        if providers.get(param.name) is not None:
+            param = param.replace(default=Depends(_dependency(container, providers[param.name], ())))
+        parameters.append(param)
+    call = _caller(func)
+    call.__name__ = func.__name__
+    call.__doc__ = func.__doc__
+    call.__signature__ = inspect.Signature(parameters)
+    return call
+
+
+def _dependency(container, name, path):
+    """
+    The FastAPI dependency for name in container.  It's generated again only when what it was
+    generated from changes: the factory, how it's scoped or cached, or the dependencies of its
+    parameters.  Otherwise FastAPI would see two dependencies and create a scoped one twice.
+    """
+    if name in path:
+        cycle = path[path.index(name):] + (name,)
+        raise ooze.InjectionError(f"Circular dependency: {' -> '.join(cycle)}")
+    parameters = _parameters(container, name, path)
+    basis = None
+    if parameters is not None:
+        basis = (container._factories[name], name in container._scoped_factories,
+                 container._scoped_factories.get(name), container._factory_caches.get(name),
+                 tuple(parameters.items()))
+    with _LOCK:
+        dependencies = _DEPENDENCIES.setdefault(container, {})
+        generated = dependencies.get(name)
+        if generated is None or generated[0] != basis:
+            generated = dependencies[name] = (basis, _generate(container, name, parameters))
+    return generated[1]
+
+
+def _parameters(container, name, path):
+    """The FastAPI dependency of each parameter of the factory for name, or None when ooze resolves name as a whole."""
+    factory_func = container._factories.get(name)
+    if factory_func is None or _answered_before_factories(container, name):
+        return None
+    parameters = {}
+    for param, provider in _providers(container, factory_func).items():
+        if provider is None:
+            raise ooze.InjectionError(f"{name} needs {param}, which isn't a valid dependency")
+        parameters[param] = _dependency(container, provider, path + (name,))
+    return parameters
+
+
+def _generate(container, name, parameters):
+    """Generate the FastAPI dependency for name, a factory or something ooze resolves as a whole."""
+    if parameters is None:
+        if not ooze._resolvable(container, name):
+            raise ooze.InjectionError(f"{name} not a valid dependency")
+
+        async def resolved():
+            return container.resolve(name)
+
+        resolved.__name__ = name
+        return resolved
+
+    factory_func = container._factories[name]
+    if name in container._scoped_factories:
+        call = _scoped_caller(factory_func, container._scoped_factories[name])
+    else:
+        call = _caller(factory_func, container._factory_caches.get(name), container)
+    call.__name__ = name
+    call.__signature__ = inspect.Signature([
+        inspect.Parameter(param, inspect.Parameter.KEYWORD_ONLY, default=Depends(generated))
+        for param, generated in parameters.items()
+    ])
+    return call
+
+
+def _answered_before_factories(container, name):
+    """Whether a provided item, or a resolver asked before the factories, has name."""
+    if name in container._instances or container._lazy_owner(name) is not None:
+        return True
+    earlier = ooze._preceding_resolvers(ooze._resolve_dependency_factory)
+    return any(resolver(name) is not ooze.DependencyNotAvailable for resolver in earlier
+               if resolver is not ooze._resolve_dependency_instance)
+
+
+def _providers(container, func):
+    """The name ooze resolves each parameter of func by, or None for those ooze can't provide."""
+    providers = {}
+    for param, provider in ooze._call_in(container, ooze._injected, func):
+        name = provider or param
+        providers[param] = name if ooze._resolvable(container, name) else None
+    return providers
+
+
+def _caller(func, cache=None, container=None):
+    """Call func with the keyword arguments FastAPI resolved, through its cache in container if it has one."""
+    if inspect.iscoroutinefunction(func):
+        async def call(**kwargs):
+            if cache is None:
+                return await func(**kwargs)
+            key = ooze._call_in(container, ooze._cache_key, kwargs, func)
+            result = cache.get(key)
+            if result is ooze.DependencyNotAvailable:
+                result = await func(**kwargs)
+                cache.put(key, result)
+            return result
+    else:
+        def call(**kwargs):
+            if cache is None:
+                return func(**kwargs)
+            key = ooze._call_in(container, ooze._cache_key, kwargs, func)
+            result = cache.get(key)
+            if result is ooze.DependencyNotAvailable:
+                result = func(**kwargs)
+                cache.put(key, result)
+            return result
+    return call
+
+
+def _scoped_caller(func, teardown):
+    """Call a scoped factory once per request and tear down what it made after the response."""
+    if inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(teardown):
+        async def call(**kwargs):
+            item = func(**kwargs)
+            if inspect.isawaitable(item):
+                item = await item
+            try:
+                yield item
+            finally:
+                if teardown is not None:
+                    result = teardown(item)
+                    if inspect.isawaitable(result):
+                        await result
+    else:
+        def call(**kwargs):
+            item = func(**kwargs)
+            try:
+                yield item
+            finally:
+                if teardown is not None:
+                    teardown(item)
+    return call
@@ -1,52 +1,586 @@
 """Reusable pool context manager"""
+import asyncio
+import bisect
+import collections
+import inspect
+import logging
+import os
 import threading
+import time
+import weakref
 from typing import Callable, Union
 
+_POOLS = weakref.WeakSet()
+
+
+class PoolTimeoutError(TimeoutError):
+    """No pool item became available in time"""
+
+
+class HistogramSnapshot(collections.namedtuple('HistogramSnapshot', ['buckets', 'counts', 'count', 'sum', 'max'])):
+    """
+    The observations of a Histogram.  counts[i] is the number of observations no larger than
+    buckets[i] and larger than the bucket before it.  The last count is for everything larger.
+    """
+
+    def quantile(self, fraction):
+        """An upper bound for the given quantile, e.g. 0.99, or None if nothing was observed."""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return bound
+        return self.max
+
+
+class Histogram:
+    """Counts observations, in seconds, in buckets with the given upper bounds"""
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observe_many(self, values):
+        if not values:
+            return
+        # Sorting once and finding each bucket's bound is much cheaper than a search per value
+        values = sorted(values)
+        previous = 0
+        for index, bound in enumerate(self.buckets):
+            position = bisect.bisect_right(values, bound, previous)
+            self.counts[index] += position - previous
+            previous = position
+        self.counts[-1] += len(values) - previous
+        self.count += len(values)
+        self.sum += sum(values)
+        self.max = max(self.max, values[-1])
+
+    def add(self, other):
+        """Add the observations of another histogram with the same buckets to this one."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def snapshot(self):
+        return HistogramSnapshot(self.buckets, tuple(self.counts), self.count, self.sum, self.max)
+
+
+PoolStats = collections.namedtuple('PoolStats', ['borrows', 'creates', 'teardowns', 'timeouts', 'idle', 'in_use',
+                                                 'wait', 'hold'])
+PoolStats.__doc__ = """
+A snapshot of a pool's counters.  wait is a HistogramSnapshot of how long borrowers waited
+for an item, including creating one, and hold one of how long they kept it.  Borrows are
+counted when the item is returned.
+"""
+
+
+class _PoolMetrics:
+    """
+    The counters and histograms of a pool.  Each thread appends its borrow timings to a list
+    of its own, so borrowing never waits for a lock, and adds them to its histograms in
+    batches.  stats() adds everything up.  The timings of threads that have finished are
+    folded into retired histograms, so a thread per request doesn't leave a list behind each.
+    """
+
+    BATCH_SIZE = 256
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.creates = 0
+        self.teardowns = 0
+        self.timeouts = 0
+        self._local = threading.local()
+        self._shards = []
+        self._retired_wait = Histogram()
+        self._retired_hold = Histogram()
+
+    def returned(self, borrowed_at, waited):
+        held = time.perf_counter() - borrowed_at
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _MetricsShard()
+            with self.lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+        samples = shard.samples
+        samples.append((waited, held))
+        if len(samples) >= self.BATCH_SIZE:
+            shard.flush()
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self, idle, in_use):
+        wait = Histogram()
+        hold = Histogram()
+        with self.lock:
+            self._retire_finished()
+            shards = [shard for _, shard in self._shards]
+            wait.add(self._retired_wait)
+            hold.add(self._retired_hold)
+            creates, teardowns, timeouts = self.creates, self.teardowns, self.timeouts
+        for shard in shards:
+            shard.add_to(wait, hold)
+        return PoolStats(wait.count, creates, teardowns, timeouts, idle, in_use, wait.snapshot(), hold.snapshot())
+
+    def _retire_finished(self):
+        """Fold the shards of threads that have finished into the retired histograms.  Call with the lock held."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                shard.add_to(self._retired_wait, self._retired_hold)
+        self._shards = live
+
+
+class _MetricsShard:
+    """One thread's (wait, hold) borrow timings.  Only that thread appends to samples."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.wait = Histogram()
+        self.hold = Histogram()
+
+    def flush(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+            waits, holds = zip(*samples)
+            self.wait.observe_many(waits)
+            self.hold.observe_many(holds)
+
+    def add_to(self, wait, hold):
+        with self.lock:
+            samples = list(self.samples)
+            wait.add(self.wait)
+            hold.add(self.hold)
+            if samples:
+                waits, holds = zip(*samples)
+                wait.observe_many(waits)
+                hold.observe_many(holds)
+
 
 class PoolItem:
-    def __init__(self, item, pool):
+    def __init__(self, item, pool, started):
         self.item = item
         self.pool = pool
+        self.borrowed_at = time.perf_counter()
+        self.waited = self.borrowed_at - started
 
     def __enter__(self):
         return self.item
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool._metrics.returned(self.borrowed_at, self.waited)
         self.pool.return_item(self.item)
 
 
 class Pool:
+    """
+    A thread-safe pool of reusable items.  Up to pool_size idle items are kept for reuse, the
+    most recently returned first so they stay warm.  When max_size is given, no more than that
+    many items exist at once and borrowers wait, up to timeout seconds, for one to be returned.
+
+    Items that fail validate when borrowed, or are older than max_lifetime seconds, are torn
+    down and replaced.  A background thread tears down items that have been idle for longer
+    than idle_timeout seconds and keeps at least min_idle items created and ready.
+
+    A forked child process starts with an empty pool.  The items it inherited still belong to
+    the parent, so they're dropped without being torn down.
+
+    stats() returns the pool's counters, and collect_stats() those of every named pool.
+    """
+
     def __init__(self, create: Callable,
                  reclaim: Union[Callable, None] = None,
                  teardown: Union[Callable, None] = None,
-                 pool_size: int = 5):
+                 pool_size: int = 5,
+                 max_size: Union[int, None] = None,
+                 timeout: Union[float, None] = None,
+                 validate: Union[Callable, None] = None,
+                 idle_timeout: Union[float, None] = None,
+                 max_lifetime: Union[float, None] = None,
+                 min_idle: int = 0,
+                 maintenance_interval: float = 1.0,
+                 name: Union[str, None] = None):
+        if max_size is not None and max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if min_idle > pool_size or (max_size is not None and min_idle > max_size):
+            raise ValueError('min_idle cannot be larger than pool_size or max_size')
         self.create = create
         self.reclaim = reclaim
         self.teardown = teardown
         self.pool_size = pool_size
-        self.items = []
-        self._lock = threading.RLock()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.validate = validate
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.min_idle = min_idle
+        self.maintenance_interval = maintenance_interval
+        self.name = name
+        self._metrics = _PoolMetrics()
+        self._idle = collections.deque()
+        self._created = {}
+        self._size = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._start_maintenance()
+        _POOLS.add(self)
+
+    def _start_maintenance(self):
+        self._stop_maintenance = threading.Event()
+        if self.idle_timeout is not None or self.min_idle:
+            threading.Thread(target=_maintain, args=(weakref.ref(self), self._stop_maintenance),
+                             name='ooze-pool-maintenance', daemon=True).start()
+
+    def _after_fork(self):
+        """Forget the parent process's items and locks.  The maintenance thread didn't survive the fork."""
+        self._idle = collections.deque()
+        self._created = {}
+        self._size = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._metrics = _PoolMetrics()
+        self._start_maintenance()
 
     def __del__(self):
-        with self._lock:
+        stop_maintenance = getattr(self, '_stop_maintenance', None)
+        if stop_maintenance is None:
+            # __init__ raised before the pool was set up
+            return
+        stop_maintenance.set()
+        while self._idle:
+            item, _ = self._idle.pop()
             if self.teardown:
-                for item in self.items:
-                    self.teardown(item)
-            self.items = []
+                self.teardown(item)
 
-    def item(self):
-        with self._lock:
-            if self.items:
-                return PoolItem(self.items.pop(0), self)
-            else:
-                return PoolItem(self.create(), self)
+    @property
+    def items(self):
+        """The idle items, least recently returned first"""
+        return [item for item, _ in self._idle]
+
+    def item(self, timeout: Union[float, None] = None):
+        started = time.perf_counter()
+        # Taking an idle item doesn't change how many items exist, so it doesn't need the lock
+        while True:
+            try:
+                item, _ = self._idle.pop()
+            except IndexError:
+                break
+            if self._usable(item):
+                return PoolItem(item, self, started)
+        return PoolItem(self._acquire(self.timeout if timeout is None else timeout), self, started)
+
+    def stats(self):
+        """A PoolStats snapshot of the pool's counters"""
+        idle = len(self._idle)
+        return self._metrics.stats(idle, max(0, self._size - idle))
+
+    def _acquire(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._available:
+                while True:
+                    try:
+                        item, _ = self._idle.pop()
+                        break
+                    except IndexError:
+                        pass
+                    if self.max_size is None or self._size < self.max_size:
+                        self._size += 1
+                        return self._create()
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._metrics.count('timeouts')
+                        raise PoolTimeoutError(f"No pool item available after {timeout} seconds")
+                    self._waiting += 1
+                    try:
+                        self._available.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            if self._usable(item):
+                return item
+
+    def _create(self):
+        """Create an item for a slot that has already been counted in _size."""
+        # The lock is released while creating so a slow create doesn't hold up other threads
+        self._lock.release()
+        try:
+            item = self.create()
+        except BaseException:
+            self._lock.acquire()
+            self._size -= 1
+            if self._waiting:
+                self._available.notify()
+            raise
+        if self.max_lifetime is not None:
+            self._created[id(item)] = time.monotonic()
+        self._metrics.count('creates')
+        self._lock.acquire()
+        return item
+
+    def _usable(self, item):
+        """Check an idle item before handing it out, discarding it when it's expired or broken."""
+        if self._expired(item):
+            self._discard(item)
+            return False
+        if self.validate:
+            try:
+                valid = self.validate(item)
+            except Exception:
+                valid = False
+            if not valid:
+                self._discard(item)
+                return False
+        return True
+
+    def _expired(self, item):
+        if self.max_lifetime is None:
+            return False
+        return time.monotonic() - self._created.get(id(item), 0) >= self.max_lifetime
 
     def return_item(self, item):
-        with self._lock:
-            while len(self.items) >= self.pool_size:
-                item = self.items.pop(0)
-                if self.teardown:
-                    self.teardown(item)
+        try:
             if self.reclaim:
                 self.reclaim(item)
-            self.items.append(item)
+        except BaseException:
+            self._discard(item)
+            raise
+        if self._expired(item):
+            self._discard(item)
+            return
+        now = time.monotonic()
+        if self.max_size is None and len(self._idle) < self.pool_size:
+            # Nobody ever waits on an unbounded pool, so there's no one to wake up
+            self._idle.append((item, now))
+            return
+        with self._lock:
+            full = len(self._idle) >= self.pool_size
+            if full:
+                # Tear down the item that has been idle the longest
+                if self._idle:
+                    self._idle.append((item, now))
+                    item, _ = self._idle.popleft()
+            else:
+                self._idle.append((item, now))
+        if full:
+            self._discard(item)
+        elif self._waiting:
+            with self._lock:
+                self._available.notify()
+
+    def _discard(self, item):
+        """Tear down an item and free its slot."""
+        with self._lock:
+            self._size -= 1
+            self._created.pop(id(item), None)
+            if self._waiting:
+                self._available.notify()
+        self._metrics.count('teardowns')
+        if self.teardown:
+            self.teardown(item)
+
+    def maintain(self):
+        """
+        Tear down items that have been idle too long and top the pool back up to min_idle.
+        This runs in the background, but can also be called directly.
+        """
+        if self.idle_timeout is not None:
+            cutoff = time.monotonic() - self.idle_timeout
+            while len(self._idle) > self.min_idle:
+                try:
+                    item, idle_since = self._idle.popleft()
+                except IndexError:
+                    break
+                if idle_since > cutoff and not self._expired(item):
+                    self._idle.appendleft((item, idle_since))
+                    break
+                self._discard(item)
+        while len(self._idle) < self.min_idle:
+            with self._lock:
+                if self.max_size is not None and self._size >= self.max_size:
+                    break
+                self._size += 1
+                item = self._create()
+                self._idle.appendleft((item, time.monotonic()))
+                if self._waiting:
+                    self._available.notify()
+
+
+def _maintain(pool_ref, stop):
+    """Run a pool's maintenance until the pool is stopped or garbage collected."""
+    while True:
+        pool = pool_ref()
+        if pool is None:
+            return
+        interval = pool.maintenance_interval
+        try:
+            pool.maintain()
+        except Exception:
+            logging.getLogger(__name__).exception('Pool maintenance failed')
+        del pool
+        if stop.wait(interval):
+            return
+
+
+class AsyncPoolItem:
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.item = None
+        self.borrowed_at = None
+        self.waited = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self.item = await self.pool.acquire(self.timeout)
+        self.borrowed_at = time.perf_counter()
+        self.waited = self.borrowed_at - started
+        return self.item
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.pool._metrics.returned(self.borrowed_at, self.waited)
+        await self.pool.return_item(self.item)
+
+
+class AsyncPool:
+    """
+    The asyncio counterpart of Pool, used with `async with pool.item() as item`.  create,
+    reclaim and teardown may be coroutine functions.  When max_size is given, borrowers
+    queue on a semaphore, in order, until an item is returned.  Like Pool, it starts out
+    empty in a forked child process.
+    """
+
+    def __init__(self, create: Callable,
+                 reclaim: Union[Callable, None] = None,
+                 teardown: Union[Callable, None] = None,
+                 pool_size: int = 5,
+                 max_size: Union[int, None] = None,
+                 timeout: Union[float, None] = None,
+                 name: Union[str, None] = None):
+        if max_size is not None and max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.create = create
+        self.reclaim = reclaim
+        self.teardown = teardown
+        self.pool_size = pool_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.name = name
+        self.items = collections.deque()
+        self._semaphore = None
+        self._in_use = 0
+        self._metrics = _PoolMetrics()
+        _POOLS.add(self)
+
+    def _after_fork(self):
+        self.items = collections.deque()
+        self._semaphore = None
+        self._in_use = 0
+        self._metrics = _PoolMetrics()
+
+    def stats(self):
+        """A PoolStats snapshot of the pool's counters"""
+        return self._metrics.stats(len(self.items), self._in_use)
+
+    def item(self, timeout: Union[float, None] = None):
+        return AsyncPoolItem(self, self.timeout if timeout is None else timeout)
+
+    async def acquire(self, timeout: Union[float, None] = None):
+        """Borrow an item.  It must be handed back with return_item."""
+        if self.max_size is not None:
+            if self._semaphore is None:
+                # Created here, rather than in __init__, so it belongs to the running loop
+                self._semaphore = asyncio.Semaphore(self.max_size)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self._metrics.count('timeouts')
+                raise PoolTimeoutError(f"No pool item available after {timeout} seconds") from None
+        try:
+            if self.items:
+                item = self.items.pop()
+            else:
+                item = await _maybe_await(self.create())
+                self._metrics.count('creates')
+        except BaseException:
+            self._release()
+            raise
+        self._in_use += 1
+        return item
+
+    async def return_item(self, item):
+        try:
+            try:
+                if self.reclaim:
+                    await _maybe_await(self.reclaim(item))
+            except BaseException:
+                await self._discard(item)
+                raise
+            if len(self.items) < self.pool_size:
+                self.items.append(item)
+                return
+            if self.items:
+                # Tear down the item that has been idle the longest
+                self.items.append(item)
+                item = self.items.popleft()
+            await self._discard(item)
+        finally:
+            self._in_use -= 1
+            self._release()
+
+    async def close(self):
+        """Tear down every idle item."""
+        while self.items:
+            await self._discard(self.items.popleft())
+
+    async def _discard(self, item):
+        """Tear down an item."""
+        self._metrics.count('teardowns')
+        if self.teardown:
+            await _maybe_await(self.teardown(item))
+
+    def _release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def collect_stats():
+    """The stats() of every pool that has a name, keyed by name, for exporting metrics"""
+    return {pool.name: pool.stats() for pool in list(_POOLS) if pool.name is not None}
+
+
+def _after_fork_in_child():
+    for pool in list(_POOLS):
+        pool._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,138 @@
+"""
+Profiling what ooze builds and resolves.
+
+    import ooze
+
+    ooze.profile()
+    ooze.run(main)
+    ooze.profile_report(tree=True)
+
+The Profiler is a hook, added with ooze.add_hook, that's told about every InjectionEvent.
+"""
+import collections
+import threading
+
+import ooze
+
+_PROFILER = None
+
+InjectionEvent = collections.namedtuple('InjectionEvent', ['kind', 'name', 'resolver', 'seconds', 'parent', 'error'])
+InjectionEvent.__doc__ = """
+What a hook is told about.  kind is 'resolve' when a resolver found name, 'build' when a
+provided class was instantiated, 'factory' when a factory ran and 'failure' when either of
+those raised.  seconds is how long building or running took, including resolving what it
+needed, and parent is the name of the dependency that needed it, if any.
+"""
+
+
+class DependencyProfile:
+    """What a Profiler recorded about one dependency"""
+
+    def __init__(self, name):
+        self.name = name
+        self.resolver = None
+        self.resolutions = 0
+        self.calls = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.children = collections.defaultdict(float)
+
+    @property
+    def self_seconds(self):
+        """The time spent in the dependency itself rather than building what it needed"""
+        return max(0.0, self.seconds - sum(self.children.values()))
+
+
+class Profiler:
+    """
+    A hook that records, for every dependency, how long it took to build or run, how often it
+    was resolved, which resolver found it and how many attempts to build it failed.  Lookups
+    that magic functions and ooze.resolve answer from their caches aren't counted.
+    """
+
+    def __init__(self):
+        self.dependencies = {}
+        self.roots = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            profile = self._profile(event.name)
+            if event.kind == 'resolve':
+                profile.resolutions += 1
+                profile.resolver = event.resolver
+            elif event.kind == 'failure':
+                profile.failures += 1
+            else:
+                profile.calls += 1
+                profile.seconds += event.seconds
+                if event.parent is None:
+                    self.roots[event.name] += event.seconds
+                else:
+                    self._profile(event.parent).children[event.name] += event.seconds
+
+    def _profile(self, name):
+        profile = self.dependencies.get(name)
+        if profile is None:
+            profile = self.dependencies[name] = DependencyProfile(name)
+        return profile
+
+    def report(self, tree=False):
+        """
+        A table of the dependencies, slowest first.  With tree, the dependencies are shown
+        under the ones that needed them instead, so the slowest path through startup is at
+        the top.
+        """
+        with self._lock:
+            return self._tree() if tree else self._table()
+
+    def _table(self):
+        lines = [f"{'Dependency':<30} {'Total ms':>10} {'Self ms':>10} {'Calls':>6} {'Resolved':>8} "
+                 f"{'Failed':>6}  Resolver"]
+        for profile in sorted(self.dependencies.values(), key=lambda profile: -profile.seconds):
+            lines.append(f"{profile.name:<30} {profile.seconds * 1000:>10.2f} {profile.self_seconds * 1000:>10.2f} "
+                         f"{profile.calls:>6} {profile.resolutions:>8} {profile.failures:>6}  "
+                         f"{_resolver_name(profile.resolver)}")
+        return '\n'.join(lines)
+
+    def _tree(self):
+        total = sum(self.roots.values()) or 1.0
+        lines = []
+
+        def add(name, seconds, depth, path):
+            lines.append(f"{'  ' * depth + name:<40} {seconds * 1000:>10.2f} ms {seconds / total:>7.1%}")
+            if name in path:
+                return
+            children = self.dependencies[name].children
+            for child in sorted(children, key=lambda child: -children[child]):
+                add(child, children[child], depth + 1, path | {name})
+
+        for root in sorted(self.roots, key=lambda root: -self.roots[root]):
+            add(root, self.roots[root], 0, frozenset())
+        return '\n'.join(lines)
+
+
+def _resolver_name(resolver):
+    if resolver is None:
+        return ''
+    return getattr(resolver, '__name__', repr(resolver)).removeprefix('_resolve_dependency_')
+
+
+def profile(enabled=True):
+    """
+    Start recording a new profile of what ooze builds and resolves, or stop recording with
+    enabled=False.  Returns the Profiler.
+    """
+    global _PROFILER
+    if _PROFILER is not None:
+        ooze.remove_hook(_PROFILER)
+    if enabled:
+        _PROFILER = ooze.add_hook(Profiler())
+    return _PROFILER
+
+
+def profile_report(tree=False, file=None):
+    """Print the report of the profile started with ooze.profile(), to stdout unless a file is given."""
+    if _PROFILER is None:
+        raise ooze.InjectionError("Profiling hasn't been started with ooze.profile()")
+    print(_PROFILER.report(tree), file=file)
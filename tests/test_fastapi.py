@@ -0,0 +1,147 @@
+"""Unit tests for the ooze.fastapi module"""
+import asyncio
+import inspect
+
+import pytest
+
+import ooze
+
+fastapi = pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+
+import ooze.fastapi  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def container():
+    with ooze.Container() as container:
+        yield container
+
+
+def test_factories_run_once_per_request(container):
+    # Given
+    calls = []
+    closed = []
+    ooze.provide_static('greeting', 'hello')
+
+    @ooze.factory
+    def settings(greeting):
+        calls.append('settings')
+        return {'greeting': greeting}
+
+    @ooze.factory(scoped=True, teardown=closed.append)
+    def session(settings):
+        return object()
+
+    @ooze.factory
+    async def audit(session, settings):
+        return session
+
+    app = fastapi.FastAPI()
+
+    @app.get('/')
+    def root(session=ooze.fastapi.depends('session'), audit=ooze.fastapi.depends('audit'),
+             greeting=ooze.fastapi.depends('greeting')):
+        return {'shared': session is audit, 'greeting': greeting}
+
+    client = TestClient(app)
+
+    # When
+    first = client.get('/').json()
+    second = client.get('/').json()
+
+    # Then
+    assert first == second == {'shared': True, 'greeting': 'hello'}
+    assert calls == ['settings', 'settings']
+    assert len(closed) == 2
+
+
+def test_injectable_leaves_other_parameters_to_fastapi(container):
+    # Given
+    @ooze.provide
+    class OrderRepository:
+        def find(self, order_id):
+            return {'id': order_id}
+
+    @ooze.fastapi.injectable
+    class OrderService:
+        def __init__(self, orderrepository, currency: str = 'EUR'):
+            self.repository = orderrepository
+            self.currency = currency
+
+    app = fastapi.FastAPI()
+
+    @app.get('/orders/{order_id}')
+    async def get_order(order_id: int, service=fastapi.Depends(OrderService)):
+        return {**service.repository.find(order_id), 'currency': service.currency}
+
+    # When
+    response = TestClient(app).get('/orders/7', params={'currency': 'USD'})
+
+    # Then
+    assert response.json() == {'id': 7, 'currency': 'USD'}
+
+
+def test_dependencies_are_generated_once(container):
+    # Given
+    ooze.provide_static('region', 'eu-west-1')
+
+    # When
+    first = ooze.fastapi.dependency('region')
+    second = ooze.fastapi.dependency('region')
+
+    # Then
+    assert first is second
+    with pytest.raises(ooze.InjectionError):
+        ooze.fastapi.dependency('not_provided')
+
+
+def test_dependencies_are_generated_again_when_their_provider_changes(container):
+    # Given
+    ooze.provide_static('name', 'world')
+    ooze.factory('greeting')(lambda name: f"hello {name}")
+    first = ooze.fastapi.dependency('greeting')
+
+    # When
+    ooze.provide_static('greeting', 'hi')
+    second = ooze.fastapi.dependency('greeting')
+
+    # Then
+    assert list(inspect.signature(first).parameters) == ['name']
+    assert list(inspect.signature(second).parameters) == []
+    assert asyncio.run(second()) == 'hi'
+
+
+def test_config_dependencies_keep_factories_shared(container, tmp_path, monkeypatch):
+    # Given
+    sessions = []
+    settings = tmp_path / 'settings.json'
+    settings.write_text('{"db_url": "sqlite://"}')
+    monkeypatch.setenv('APPLICATION_SETTINGS', str(settings))
+    ooze.reload_config()
+
+    @ooze.factory(scoped=True)
+    def session():
+        sessions.append(1)
+        return object()
+
+    @ooze.factory
+    def repo(session):
+        return session
+
+    app = fastapi.FastAPI()
+
+    # The first read of the settings, while the routes are declared, changes the graph version
+    @app.get('/')
+    def root(s=ooze.fastapi.depends('session'), url=ooze.fastapi.depends('db_url'), r=ooze.fastapi.depends('repo')):
+        return {'shared': s is r, 'url': url}
+
+    # When
+    response = TestClient(app).get('/').json()
+    monkeypatch.undo()
+    ooze.reload_config()
+
+    # Then
+    assert response == {'shared': True, 'url': 'sqlite://'}
+    assert sessions == [1]
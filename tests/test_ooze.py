@@ -1,6 +1,14 @@
 """Testing ooze dependency injection."""
+import asyncio
+import collections
+import functools
+import gc
+import json
 import os
-from io import BytesIO
+import threading
+import time
+import typing
+import weakref
 from unittest.mock import call
 
 import pytest
@@ -132,6 +140,7 @@ def test_factory():
 def test_environment_resolution():
     # Given
     os.environ['URL'] = 'https://github.com/'
+    ooze.reload_environment()
 
     # When
     result = ooze.resolve('url')
@@ -140,51 +149,69 @@ def test_environment_resolution():
     assert result == 'https://github.com/'
 
 
-def test_config_resolution_json(mocker):
+@pytest.fixture
+def empty_graph(monkeypatch):
+    # Swapping the default container, rather than entering one, so threads see it too
+    container = ooze.Container()
+    monkeypatch.setattr(ooze, '_DEFAULT_CONTAINER', container)
+    yield container
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    yield monkeypatch
+    monkeypatch.undo()
+    ooze.configure_environment()
+
+
+@pytest.fixture
+def original_resolvers():
+    resolvers = ooze.resolvers()
+    yield resolvers
+    ooze.set_resolvers(resolvers)
+
+
+@pytest.fixture
+def typed_graph(empty_graph):
+    ooze.typed_injection()
+    yield empty_graph
+    ooze.typed_injection(False)
+
+
+@pytest.fixture
+def settings_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('APPLICATION_SETTINGS', raising=False)
+    ooze.reload_config()
+    yield tmp_path
+    ooze.reload_config()
+
+
+def test_config_resolution_json(settings_dir):
     # Given
-    mock_open = mocker.patch('ooze.open')
-    mock_open.side_effect = [
-        BytesIO(bytes('{"json_url": "https://github.com"}', 'utf-8')),
-        FileNotFoundError,
-        FileNotFoundError
-    ]
+    (settings_dir / 'application_settings.json').write_text('{"json_url": "https://github.com"}')
 
     # When
     result = ooze.resolve('json_url')
 
     # Then
     assert result == "https://github.com"
-    mock_open.assert_called_with('application_settings.json')
 
 
-def test_config_resolution_yaml(mocker):
+def test_config_resolution_yaml(settings_dir):
     # Given
-    mock_open = mocker.patch('ooze.open')
-    mock_open.side_effect = [
-        FileNotFoundError,
-        BytesIO(bytes("""
-        yaml_url: https://github.com
-        """, 'utf-8')),
-        FileNotFoundError
-    ]
+    (settings_dir / 'application_settings.yml').write_text("""
+    yaml_url: https://github.com
+    """)
 
     # When
     result = ooze.resolve('yaml_url')
 
     # Then
     assert result == "https://github.com"
-    mock_open.assert_called_with('application_settings.yml')
 
 
-def test_config_resolution_file_not_found(mocker):
-    # Given
-    mock_open = mocker.patch('ooze.open')
-    mock_open.side_effect = [
-        FileNotFoundError,
-        FileNotFoundError,
-        FileNotFoundError
-    ]
-
+def test_config_resolution_file_not_found(settings_dir):
     # When
     with pytest.raises(ooze.InjectionError) as exc_info:
         ooze.resolve('fnf_url')
@@ -193,23 +220,134 @@ def test_config_resolution_file_not_found(mocker):
     assert exc_info.value.args[0] == 'fnf_url not a valid dependency'
 
 
-def test_config_resolution_manual_file(mocker):
+def test_config_resolution_manual_file(settings_dir, monkeypatch):
     # Given
-    os.environ['APPLICATION_SETTINGS'] = '/tmp/app.yaml'
-    mock_open = mocker.patch('ooze.open')
-    mock_open.side_effect = [
-        BytesIO(bytes('{"manual_url": "https://github.com"}', 'utf-8')),
-        FileNotFoundError,
-        FileNotFoundError,
-        FileNotFoundError
-    ]
+    manual_file = settings_dir / 'app.yaml'
+    manual_file.write_text('{"manual_url": "https://github.com"}')
+    (settings_dir / 'application_settings.json').write_text('{"manual_url": "https://example.com"}')
+    monkeypatch.setenv('APPLICATION_SETTINGS', str(manual_file))
 
     # When
     result = ooze.resolve('manual_url')
 
     # Then
     assert result == 'https://github.com'
-    mock_open.assert_called_with('/tmp/app.yaml')
+
+
+def test_config_resolution_parses_once(settings_dir, mocker):
+    # Given
+    (settings_dir / 'application_settings.yaml').write_text('cached_url: https://github.com')
+    spy = mocker.spy(ooze.yaml, 'load')
+
+    # When
+    results = [ooze.resolve('cached_url') for _ in range(3)]
+
+    # Then
+    assert results == ['https://github.com'] * 3
+    assert spy.call_count == 1
+
+
+def test_config_resolution_detects_modified_file(settings_dir, mocker):
+    # Given
+    settings = settings_dir / 'application_settings.yaml'
+    settings.write_text('changing_url: https://github.com')
+    assert ooze.resolve('changing_url') == 'https://github.com'
+    mocker.patch('ooze.CONFIG_CHECK_INTERVAL', 0)
+
+    # When
+    settings.write_text('changing_url: https://gitlab.com/brettschneider')
+
+    # Then
+    assert ooze.resolve('changing_url') == 'https://gitlab.com/brettschneider'
+
+
+def test_reload_config(settings_dir):
+    # Given
+    settings = settings_dir / 'application_settings.yaml'
+    settings.write_text('reloaded_url: https://github.com')
+    assert ooze.resolve('reloaded_url') == 'https://github.com'
+    settings.write_text('reloaded_url: https://gitlab.com')
+
+    # When
+    ooze.reload_config()
+
+    # Then
+    assert ooze.resolve('reloaded_url') == 'https://gitlab.com'
+
+
+def test_config_layers_merge_and_index_dotted_keys(settings_dir, monkeypatch):
+    # Given
+    (settings_dir / 'base.yaml').write_text('database:\n  host: localhost\n  port: 5432\nlog_level: info\n')
+    (settings_dir / 'production.json').write_text('{"database": {"host": "db.internal"}}')
+    (settings_dir / 'local.env').write_text('# Overrides\nexport LOG_LEVEL="debug"\n')
+    monkeypatch.setenv('APPLICATION_SETTINGS', os.pathsep.join(['base.yaml', 'production.json', 'local.env']))
+
+    # When
+    database = ooze.resolve('database')
+
+    # Then
+    assert database == {'host': 'db.internal', 'port': 5432}
+    assert ooze.resolve('database.host') == 'db.internal'
+    assert ooze.resolve('database.port') == 5432
+    assert ooze.resolve('log_level') == 'debug'
+    assert ooze.resolve('LOG_LEVEL') == 'debug'
+
+
+def test_config_dotenv_keys_override_in_any_case(settings_dir, monkeypatch):
+    # Given
+    (settings_dir / 'base.yaml').write_text('LOG_LEVEL: info\nregion: eu-west-1\n')
+    (settings_dir / 'local.env').write_text('LOG_LEVEL=debug\nREGION=us-east-1\nTIMEOUT=30\n')
+    (settings_dir / 'override.json').write_text('{"timeout": "60"}')
+    monkeypatch.setenv('APPLICATION_SETTINGS', os.pathsep.join(['base.yaml', 'local.env', 'override.json']))
+
+    # When
+    log_levels = ooze.resolve('LOG_LEVEL'), ooze.resolve('log_level')
+    regions = ooze.resolve('REGION'), ooze.resolve('region')
+    timeouts = ooze.resolve('TIMEOUT'), ooze.resolve('timeout')
+
+    # Then
+    assert log_levels == ('debug', 'debug')
+    assert regions == ('us-east-1', 'us-east-1')
+    assert timeouts == ('60', '60')
+
+
+@pytest.mark.skipif(ooze.tomllib is None, reason='Needs tomllib or tomli')
+def test_config_resolution_toml(settings_dir):
+    # Given
+    (settings_dir / 'application_settings.toml').write_text('[server]\nworkers = 4\n')
+
+    # When
+    result = ooze.resolve('server.workers')
+
+    # Then
+    assert result == 4
+
+
+def test_config_parser_registry(settings_dir, monkeypatch):
+    # Given
+    (settings_dir / 'settings.ini').write_text('ini_url=https://github.com')
+    monkeypatch.setenv('APPLICATION_SETTINGS', 'settings.ini')
+    monkeypatch.setitem(ooze._CONFIG_PARSERS, '.ini', None)  # So it's removed again afterwards
+    ooze.register_config_parser('.INI', lambda infile: dict([infile.read().split('=', 1)]))
+
+    # When
+    result = ooze.resolve('ini_url')
+
+    # Then
+    assert result == 'https://github.com'
+
+
+def test_config_unsupported_extension(settings_dir, monkeypatch):
+    # Given
+    (settings_dir / 'settings.xml').write_text('<settings/>')
+    monkeypatch.setenv('APPLICATION_SETTINGS', 'settings.xml')
+
+    # When
+    with pytest.raises(ooze.ConfigurationError) as exc_info:
+        ooze.resolve('xml_url')
+
+    # Then
+    assert exc_info.value.args[0] == 'Configuration files with .xml extension not supported'
 
 
 def test_magic_resolves():
@@ -244,3 +382,1277 @@ def test_magic_fails_as_expected():
 
     # Then
     assert exc_info.value.args[0] == 'hostname not a valid dependency'
+
+
+def test_magic_inspects_signature_once(mocker):
+    # Given
+    @ooze.magic
+    def describe(hostname, version):
+        return f"{hostname} {version}"
+
+    spy = mocker.spy(ooze.inspect, 'signature')
+
+    # When
+    results = [describe('localhost') for _ in range(3)]
+
+    # Then
+    assert results == ['localhost 1.0.0'] * 3
+    assert spy.call_count == 1
+
+
+def test_magic_rebinds_when_graph_changes():
+    # Given
+    @ooze.magic
+    def describe(planned_value):
+        return planned_value
+
+    ooze.provide_static('planned_value', 'first')
+    assert describe() == 'first'
+
+    # When
+    ooze.provide_static('planned_value', 'second')
+
+    # Then
+    assert describe() == 'second'
+
+
+def test_classes_instantiated_once_in_dependency_order(empty_graph):
+    # Given
+    constructed = []
+
+    @ooze.provide
+    class Repository:
+        def __init__(self, connection, version):
+            constructed.append('repository')
+
+    @ooze.factory('connection')
+    def connect(engine):
+        return engine
+
+    @ooze.provide
+    class Engine:
+        def __init__(self):
+            constructed.append('engine')
+
+    ooze.provide_static('version', '1.0.0')
+
+    # When
+    order = ooze.instantiation_order()
+    ooze.resolve('repository')
+
+    # Then
+    assert order == ['engine', 'repository']
+    assert constructed == ['engine', 'repository']
+    assert ooze.instantiation_order() == order
+
+
+def test_instantiation_order_looks_through_lazy_classes(empty_graph):
+    # Given
+    @ooze.provide
+    class Top:
+        def __init__(self, middle):
+            self.middle = middle
+
+    @ooze.provide(lazy=True)
+    class Middle:
+        def __init__(self, base):
+            self.base = base
+
+    @ooze.provide
+    class Base:
+        pass
+
+    # When
+    order = ooze.instantiation_order()
+    top = ooze.resolve('top')
+
+    # Then
+    assert order == ['base', 'top']
+    assert isinstance(top.middle.base, Base)
+
+
+def test_circular_dependencies_reported_with_path(empty_graph):
+    # Given
+    @ooze.provide
+    class Alpha:
+        def __init__(self, beta):
+            pass
+
+    @ooze.provide
+    class Beta:
+        def __init__(self, gamma):
+            pass
+
+    @ooze.provide
+    class Gamma:
+        def __init__(self, alpha):
+            pass
+
+    # When
+    with pytest.raises(ooze.InjectionError) as exc_info:
+        ooze.resolve('alpha')
+
+    # Then
+    assert exc_info.value.args[0] == 'Circular dependency: alpha -> beta -> gamma -> alpha'
+
+
+def test_missing_class_dependencies_reported(empty_graph):
+    # Given
+    @ooze.provide
+    class Orphan:
+        def __init__(self, itza_notta_thera):
+            pass
+
+    @ooze.provide
+    class NeedsOrphan:
+        def __init__(self, orphan):
+            pass
+
+    # When
+    with pytest.raises(ooze.InjectionError) as exc_info:
+        ooze.resolve('orphan')
+
+    # Then
+    assert exc_info.value.args[0] == 'The following classes have missing dependencies: orphan, needsorphan'
+
+
+def test_lazy_provider_instantiated_on_first_use(empty_graph):
+    # Given
+    constructed = []
+
+    @ooze.provide(lazy=True)
+    class HeavyClient:
+        def __init__(self, version):
+            constructed.append(version)
+
+    ooze.provide_static('version', '1.0.0')
+    ooze.run(lambda: None)
+    assert constructed == []
+
+    # When
+    client = ooze.resolve('heavyclient')
+
+    # Then
+    assert isinstance(client, HeavyClient)
+    assert ooze.resolve('heavyclient') is client
+    assert constructed == ['1.0.0']
+
+
+def test_lazy_providers_setting(empty_graph, monkeypatch):
+    # Given
+    monkeypatch.setattr(ooze, 'LAZY_PROVIDERS', True)
+    constructed = []
+
+    @ooze.provide('named_client')
+    class NamedClient:
+        def __init__(self):
+            constructed.append(self)
+
+    # When
+    ooze.run(lambda: None)
+    client = ooze.resolve('named_client')
+
+    # Then
+    assert constructed == [client]
+
+
+def test_lazy_provider_built_once_across_threads(empty_graph):
+    # Given
+    constructed = []
+    barrier = threading.Barrier(16)
+
+    @ooze.provide(lazy=True)
+    class SlowClient:
+        def __init__(self):
+            constructed.append(self)
+
+    def worker():
+        barrier.wait()
+        results.append(ooze.resolve('slowclient'))
+
+    results = []
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+
+    # When
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then
+    assert len(constructed) == 1
+    assert results == constructed * 16
+
+
+def test_scoped_factory_shared_within_scope(empty_graph):
+    # Given
+    closed = []
+
+    @ooze.factory('db_session', scoped=True, teardown=closed.append)
+    def open_session():
+        return object()
+
+    @ooze.magic
+    def handle_request(db_session, repository_session):
+        return db_session, repository_session
+
+    ooze.factory('repository_session')(lambda db_session: db_session)
+
+    # When
+    with ooze.scope():
+        first, also_first = handle_request()
+        assert closed == []
+    second, also_second = handle_request()
+
+    # Then
+    assert first is also_first
+    assert second is also_second
+    assert first is not second
+    assert closed == [first, second]
+
+
+def test_magic_scope_outlasts_coroutines_and_generators(empty_graph):
+    # Given
+    closed = []
+    ooze.factory('db_session', scoped=True, teardown=closed.append)(object)
+
+    @ooze.magic
+    async def handle_request(db_session):
+        await asyncio.sleep(0)
+        return db_session in closed
+
+    @ooze.magic
+    def stream_rows(db_session):
+        yield db_session in closed
+        yield db_session in closed
+
+    @ooze.magic
+    async def stream_events(db_session):
+        await asyncio.sleep(0)
+        yield db_session in closed
+
+    async def consume_events():
+        return [closed_early async for closed_early in stream_events()]
+
+    # When
+    handled = asyncio.run(handle_request())
+    streamed = list(stream_rows())
+    events = asyncio.run(consume_events())
+
+    # Then
+    assert handled is False
+    assert streamed == [False, False]
+    assert events == [False]
+    assert len(closed) == 3
+
+
+def test_scoped_factory_requires_scope(empty_graph):
+    # Given
+    ooze.factory('db_session', scoped=True)(object)
+
+    # When
+    with pytest.raises(ooze.InjectionError) as exc_info:
+        ooze.resolve('db_session')
+
+    # Then
+    assert exc_info.value.args[0] == 'db_session can only be resolved inside an ooze.scope()'
+
+
+def test_bottle_plugin_scopes_each_request(empty_graph):
+    # Given
+    closed = []
+    ooze.factory('db_session', scoped=True, teardown=closed.append)(object)
+    ooze.provide_static('version', '1.0.0')
+
+    def route(item_id, db_session, version):
+        return item_id, db_session, version
+
+    wrapper = ooze.OozeBottlePlugin().apply(route, None)
+
+    # When
+    first = wrapper(item_id=1)
+    second = wrapper(item_id=2)
+
+    # Then
+    assert first[1] is not second[1]
+    assert (first[0], first[2]) == (1, '1.0.0')
+    assert closed == [first[1], second[1]]
+
+
+def test_bottle_plugin_evaluates_factories_per_request(empty_graph, environment):
+    # Given
+    calls = []
+    ooze.factory('request_id')(lambda: calls.append(1) or len(calls))
+    ooze.provide_static('version', '1.0.0')
+    environment.setenv('FEATURE_FLAG', 'off')
+    ooze.reload_environment()
+
+    def route(item_id, request_id, version, feature_flag, csrf_token):
+        return item_id, request_id, version, feature_flag, csrf_token
+
+    wrapper = ooze.OozeBottlePlugin().apply(route, None)
+
+    # When
+    first = wrapper(item_id=1, csrf_token='from another plugin')
+    environment.setenv('FEATURE_FLAG', 'on')
+    ooze.reload_environment()
+    second = wrapper(item_id=2, csrf_token='from another plugin', version='given')
+
+    # Then
+    assert first == (1, 1, '1.0.0', 'off', 'from another plugin')
+    assert second == (2, 2, 'given', 'on', 'from another plugin')
+
+
+def test_bottle_plugin_leaves_routes_without_dependencies_alone(empty_graph):
+    # Given
+    def route(item_id):
+        return item_id
+
+    # When
+    wrapper = ooze.OozeBottlePlugin().apply(route, None)
+
+    # Then
+    assert wrapper is route
+
+
+def test_bottle_plugin_serves_from_the_container_it_was_applied_in(empty_graph):
+    # Given
+    container = ooze.Container()
+    container.provide_static('version', '2.0.0')
+    container.factory('request_id')(lambda: 42)
+
+    def route(item_id, request_id, version):
+        return item_id, request_id, version
+
+    with container:
+        wrapper = ooze.OozeBottlePlugin().apply(route, None)
+
+    # When
+    result = wrapper(item_id=1)
+
+    # Then
+    assert result == (1, 42, '2.0.0')
+
+
+def test_run_async_awaits_factories_concurrently(empty_graph):
+    # Given
+    async def slow_client(name):
+        await asyncio.sleep(0.1)
+        return name
+
+    for name in ('users', 'orders', 'billing'):
+        ooze.factory(f"{name}_client")(functools.partial(slow_client, name))
+
+    async def handler(users_client, orders_client, billing_client):
+        return [users_client, orders_client, billing_client]
+
+    # When
+    started = time.perf_counter()
+    result = asyncio.run(ooze.run_async(handler))
+    elapsed = time.perf_counter() - started
+
+    # Then
+    assert result == ['users', 'orders', 'billing']
+    assert elapsed < 0.25
+
+
+def test_resolve_async_awaits_class_initializers(empty_graph):
+    # Given
+    @ooze.factory
+    async def connection_string():
+        return 'sqlite://'
+
+    @ooze.provide
+    class Database:
+        def __init__(self, connection_string):
+            self.connection_string = connection_string
+            self.connected = False
+
+        async def ainit(self):
+            self.connected = True
+
+    # When
+    database = asyncio.run(ooze.resolve_async('database'))
+
+    # Then
+    assert database.connection_string == 'sqlite://'
+    assert database.connected
+
+
+def test_async_scoped_factory_shared_by_concurrent_consumers(empty_graph):
+    # Given
+    created = []
+
+    @ooze.factory('db_session', scoped=True)
+    async def open_session():
+        await asyncio.sleep(0.01)
+        created.append(object())
+        return created[-1]
+
+    ooze.factory('orders')(lambda db_session: db_session)
+    ooze.factory('users')(lambda db_session: db_session)
+
+    async def handler(orders, users, db_session):
+        return orders, users, db_session
+
+    # When
+    orders, users, db_session = asyncio.run(ooze.run_async(handler))
+
+    # Then
+    assert len(created) == 1
+    assert orders is users is db_session is created[0]
+
+
+def test_parallel_startup_builds_independent_classes_concurrently(empty_graph):
+    # Given
+    class SlowToConnect:
+        def __init__(self):
+            time.sleep(0.1)
+
+    for name in ('cache', 'search', 'queue', 'mailer'):
+        ooze.provide(name)(type(name, (SlowToConnect,), {}))
+
+    @ooze.provide
+    class App:
+        def __init__(self, cache, search, queue, mailer):
+            pass
+
+    # When
+    started = time.perf_counter()
+    ooze.run(lambda app: app, parallel=4)
+    elapsed = time.perf_counter() - started
+
+    # Then
+    assert elapsed < 0.35
+    assert ooze.instantiation_order()[-1] == 'app'
+
+
+def test_parallel_startup_aggregates_errors(empty_graph):
+    # Given
+    @ooze.provide
+    class Broken:
+        def __init__(self):
+            raise ValueError('cannot connect')
+
+    @ooze.provide
+    class AlsoBroken:
+        def __init__(self):
+            raise RuntimeError('no model')
+
+    @ooze.provide
+    class Fine:
+        pass
+
+    # When
+    with pytest.raises(ooze.StartupError) as exc_info:
+        ooze.run(lambda: None, parallel=2)
+
+    # Then
+    assert set(exc_info.value.errors) == {'broken', 'alsobroken'}
+    assert isinstance(exc_info.value.errors['broken'], ValueError)
+    assert exc_info.value.args[0] == ('The following classes failed to instantiate: '
+                                      'broken (ValueError: cannot connect), alsobroken (RuntimeError: no model)')
+
+
+def test_cached_factory_runs_once_per_argument_values(empty_graph):
+    # Given
+    calls = []
+
+    @ooze.factory('token', cache=True)
+    def fetch_token(client_id):
+        calls.append(client_id)
+        return f"token-for-{client_id}"
+
+    ooze.provide_static('client_id', 'first')
+
+    # When
+    results = [ooze.resolve('token') for _ in range(3)]
+    ooze.provide_static('client_id', 'second')
+    results.append(ooze.resolve('token'))
+
+    # Then
+    assert results == ['token-for-first'] * 3 + ['token-for-second']
+    assert calls == ['first', 'second']
+    assert ooze.cache_info('token') == ooze.CacheInfo(hits=2, misses=2, maxsize=None, currsize=2)
+
+
+def test_cached_factory_keys_unhashable_arguments_by_identity(empty_graph):
+    # Given
+    calls = []
+
+    @ooze.factory('client', cache=True)
+    def make_client(client_settings, region):
+        calls.append(region)
+        return object()
+
+    ooze.provide_static('client_settings', {'timeout': 30})
+    ooze.provide_static('region', 'eu-west-1')
+
+    # When
+    first = ooze.resolve('client')
+    cached = ooze.resolve('client')
+    ooze.provide_static('client_settings', {'timeout': 30})
+    replaced = ooze.resolve('client')
+
+    # Then
+    assert first is cached
+    assert replaced is not first
+    assert calls == ['eu-west-1', 'eu-west-1']
+
+
+def test_cached_factory_skips_unhashable_arguments_from_factories(empty_graph):
+    # Given
+    calls = []
+    ooze.factory('client_settings')(lambda: {'timeout': 30})
+
+    @ooze.factory('client', cache=True)
+    def make_client(client_settings):
+        calls.append(client_settings)
+        return object()
+
+    # When
+    clients = [ooze.resolve('client') for _ in range(100)]
+
+    # Then
+    assert len(set(map(id, clients))) == 100
+    assert len(calls) == 100
+    assert ooze.cache_info('client').currsize == 0
+
+
+def test_cache_drops_expired_results():
+    # Given
+    cache = ooze.FactoryCache(ttl=0.01)
+    for key in range(100):
+        cache.put((key,), key)
+
+    # When
+    time.sleep(0.02)
+    cache.put(('fresh',), 'fresh')
+
+    # Then
+    assert cache.info().currsize == 1
+    assert cache.get(('fresh',)) == 'fresh'
+
+
+def test_cached_factory_ttl_and_invalidate(empty_graph):
+    # Given
+    calls = []
+    ooze.factory('remote_config', cache=ooze.FactoryCache(ttl=0.05))(lambda: calls.append(1) or len(calls))
+
+    # When
+    first = ooze.resolve('remote_config')
+    cached = ooze.resolve('remote_config')
+    time.sleep(0.06)
+    expired = ooze.resolve('remote_config')
+    ooze.invalidate('remote_config')
+    invalidated = ooze.resolve('remote_config')
+
+    # Then
+    assert (first, cached, expired, invalidated) == (1, 1, 2, 3)
+
+
+def test_cached_factory_lru_eviction():
+    # Given
+    cache = ooze.FactoryCache(maxsize=2)
+    for key in ('a', 'b'):
+        cache.put((key,), key.upper())
+
+    # When
+    cache.get(('a',))
+    cache.put(('c',), 'C')
+
+    # Then
+    assert cache.get(('a',)) == 'A'
+    assert cache.get(('b',)) is ooze.DependencyNotAvailable
+    assert cache.get(('c',)) == 'C'
+
+
+def test_environment_snapshot_needs_reload(environment):
+    # Given
+    environment.setenv('SNAPSHOT_URL', 'https://github.com/')
+    ooze.reload_environment()
+    assert ooze.resolve('snapshot_url') == 'https://github.com/'
+
+    # When
+    environment.setenv('SNAPSHOT_URL', 'https://gitlab.com/')
+
+    # Then
+    assert ooze.resolve('snapshot_url') == 'https://github.com/'
+    ooze.reload_environment()
+    assert ooze.resolve('snapshot_url') == 'https://gitlab.com/'
+
+
+def test_environment_prefix_and_types(environment):
+    # Given
+    environment.setenv('MYAPP_PORT', '8080')
+    environment.setenv('MYAPP_DEBUG', 'yes')
+    environment.setenv('MYAPP_HOSTS', '["a", "b"]')
+    environment.setenv('UNPREFIXED_SETTING', 'hidden')
+
+    # When
+    ooze.configure_environment(prefix='MYAPP_', types={'port': int, 'debug': bool, 'hosts': 'json'})
+
+    # Then
+    assert ooze.resolve('port') == 8080
+    assert ooze.resolve('debug') is True
+    assert ooze.resolve('hosts') == ['a', 'b']
+    with pytest.raises(ooze.InjectionError):
+        ooze.resolve('unprefixed_setting')
+
+
+def test_environment_invalid_type(environment):
+    # Given
+    environment.setenv('WORKERS', 'many')
+    ooze.configure_environment(types={'workers': int})
+
+    # When
+    with pytest.raises(ooze.ConfigurationError) as exc_info:
+        ooze.resolve('workers')
+
+    # Then
+    assert exc_info.value.args[0].startswith('Environment variable for workers is not a valid')
+
+
+def test_environment_after_provided_items(environment):
+    # Given
+    environment.setenv('VERSION', '9.9.9')
+
+    # When
+    ooze.configure_environment(first=False)
+
+    # Then
+    assert ooze.resolve('version') == '1.0.0'
+
+
+def test_custom_resolver(original_resolvers):
+    # Given
+    secrets = {'api_key': 's3cr3t', 'version': '0.0.1'}
+
+    # When
+    ooze.register_resolver(lambda name: secrets.get(name, ooze.DependencyNotAvailable))
+
+    # Then
+    assert ooze.resolve('api_key') == 's3cr3t'
+    assert ooze.resolve('version') == '1.0.0'
+    assert ooze.resolvers()[:-1] == original_resolvers
+
+
+def test_reordered_resolvers(original_resolvers):
+    # Given
+    secrets = {'version': '0.0.1'}
+    ooze.register_resolver(lambda name: secrets.get(name, ooze.DependencyNotAvailable), position=0)
+
+    # When
+    result = greet('localhost')
+
+    # Then
+    assert result == 'Hostname: localhost, Version: 0.0.1'
+
+
+def test_resolver_index_skips_earlier_resolvers(original_resolvers):
+    # Given
+    asked = []
+
+    def counting_resolver(name):
+        asked.append(name)
+        return ooze.DependencyNotAvailable
+
+    def vault_resolver(name):
+        return 'from-vault' if name == 'vault_token' else ooze.DependencyNotAvailable
+
+    ooze.set_resolvers([counting_resolver] + original_resolvers + [vault_resolver])
+
+    # When
+    results = [ooze.resolve('vault_token') for _ in range(3)]
+    ooze.graph_changed()
+    results.append(ooze.resolve('vault_token'))
+
+    # Then
+    assert results == ['from-vault'] * 4
+    assert asked == ['vault_token', 'vault_token']
+
+
+def test_resolve_caches_singletons_until_graph_changes(mocker):
+    # Given
+    ooze.provide_static('cached_singleton', 'first')
+    assert ooze.resolve('cached_singleton') == 'first'
+    spy = mocker.spy(ooze, '_resolve_dependency')
+
+    # When
+    cached = [ooze.resolve('cached_singleton') for _ in range(3)]
+    ooze.provide_static('cached_singleton', 'second')
+    changed = ooze.resolve('cached_singleton')
+
+    # Then
+    assert cached == ['first'] * 3
+    assert changed == 'second'
+    assert spy.call_count == 1
+
+
+def test_resolve_does_not_cache_factories():
+    # Given
+    calls = []
+    ooze.factory('uncached_factory')(lambda: calls.append(1) or len(calls))
+
+    # When
+    results = [ooze.resolve('uncached_factory') for _ in range(3)]
+
+    # Then
+    assert results == [1, 2, 3]
+
+
+def test_containers_are_isolated():
+    # Given
+    first = ooze.Container()
+    second = ooze.Container()
+    first.provide_static('tenant', 'first')
+    second.provide_static('tenant', 'second')
+
+    # When
+    with first:
+        resolved = ooze.resolve('tenant')
+
+    # Then
+    assert resolved == 'first'
+    assert second.resolve('tenant') == 'second'
+    assert ooze.current_container() is not first
+    with pytest.raises(ooze.InjectionError):
+        ooze.resolve('tenant')
+
+
+def test_introspection_does_not_keep_containers_alive():
+    # Given
+    container = ooze.Container()
+
+    @container.provide
+    class TenantClient:
+        def __init__(self, tenant: str):
+            self.tenant = tenant
+
+    container.provide_static('tenant', 'acme')
+    container.factory('greeting')(lambda tenant: f"hello {tenant}")
+    assert container.resolve('greeting') == 'hello acme'
+    assert container.resolve('tenantclient').tenant == 'acme'
+    client_class = weakref.ref(TenantClient)
+
+    # When
+    del container, TenantClient
+    gc.collect()
+
+    # Then
+    assert client_class() is None
+
+
+def test_child_container_overrides_parent():
+    # Given
+    parent = ooze.Container()
+    parent.provide_static('database_url', 'postgres://production')
+
+    @parent.provide
+    class Cache:
+        pass
+
+    @parent.factory
+    def connection(database_url):
+        return f"connected to {database_url}"
+
+    child = parent.child()
+    child.provide_static('database_url', 'sqlite://')
+
+    # When
+    child_connection = child.resolve('connection')
+    parent_connection = parent.resolve('connection')
+
+    # Then
+    assert child_connection == 'connected to sqlite://'
+    assert parent_connection == 'connected to postgres://production'
+    assert child.resolve('cache') is parent.resolve('cache')
+
+
+def test_child_container_builds_its_own_classes_after_parent():
+    # Given
+    parent = ooze.Container()
+    parent.provide_static('greeting', 'hello')
+
+    @parent.provide
+    class Greeter:
+        def __init__(self, greeting):
+            self.greeting = greeting
+
+    child = parent.child()
+
+    @child.provide('greeter')
+    class LoudGreeter:
+        def __init__(self, greeting):
+            self.greeting = greeting.upper()
+
+    # When
+    greeting = child.run(lambda greeter: greeter.greeting)
+
+    # Then
+    assert greeting == 'HELLO'
+    assert parent.resolve('greeter').greeting == 'hello'
+    assert parent.instantiation_order() == ['greeter']
+
+
+def test_container_magic_injects_from_its_container():
+    # Given
+    tenants = {}
+    for name in ('acme', 'globex'):
+        tenants[name] = ooze.Container()
+        tenants[name].provide_static('tenant_name', name)
+
+    def show_tenant(tenant_name):
+        return tenant_name
+
+    # When
+    routes = {name: container.magic(show_tenant) for name, container in tenants.items()}
+
+    # Then
+    assert routes['acme']() == 'acme'
+    assert routes['globex']() == 'globex'
+
+
+def test_child_container_async_resolve_uses_parent_lazy_class():
+    # Given
+    parent = ooze.Container()
+    constructed = []
+
+    @parent.provide(lazy=True)
+    class Client:
+        def __init__(self):
+            constructed.append(self)
+
+    child = parent.child()
+
+    # When
+    client = asyncio.run(child.resolve_async('client'))
+
+    # Then
+    assert constructed == [client]
+    assert parent.resolve('client') is client
+
+
+def test_container_entered_by_overlapping_tasks():
+    # Given
+    container = ooze.Container()
+    container.provide_static('greeting', 'hello')
+
+    async def task(delay):
+        with container:
+            await asyncio.sleep(delay)
+            greeting = ooze.resolve('greeting')
+        return greeting, ooze.current_container() is container
+
+    async def main():
+        return await asyncio.gather(task(0.01), task(0.02))
+
+    # When
+    results = asyncio.run(main())
+
+    # Then
+    assert results == [('hello', False), ('hello', False)]
+
+
+def test_frozen_manifest_skips_introspection(empty_graph, tmp_path, monkeypatch, mocker):
+    # Given
+    manifest_file = tmp_path / 'manifest.json'
+    ooze.provide_static('greeting', 'hello')
+
+    @ooze.provide
+    class Greeter:
+        def __init__(self, greeting, punctuation):
+            self.message = greeting + punctuation
+
+    @ooze.factory
+    def punctuation():
+        return '!'
+
+    ooze.freeze(manifest_file)
+    monkeypatch.setattr(ooze, '_PARAMETERS', {})
+    spy = mocker.spy(ooze.inspect, 'signature')
+
+    # When
+    loaded = ooze.load_manifest(manifest_file)
+    message = ooze.run(lambda greeter: greeter.message)
+
+    # Then
+    assert loaded
+    assert message == 'hello!'
+    assert spy.call_count == 1  # Only the lambda passed to run wasn't in the manifest
+
+
+def test_manifest_tells_lambdas_apart(empty_graph, tmp_path):
+    # Given
+    manifest_file = tmp_path / 'manifest.json'
+    ooze.provide_static('x', 1)
+    ooze.provide_static('y', 2)
+    ooze.factory('a')(lambda x: x * 10)
+    ooze.factory('b')(lambda y: y * 100)
+
+    # When
+    manifest = ooze.freeze(manifest_file)
+    loaded = ooze.load_manifest(manifest_file)
+
+    # Then
+    assert loaded
+    assert manifest['parameters'] == {'a': ['x'], 'b': ['y']}
+    assert (ooze.resolve('a'), ooze.resolve('b')) == (10, 200)
+
+
+def test_stale_manifest_ignored(empty_graph, tmp_path):
+    # Given
+    manifest_file = tmp_path / 'manifest.json'
+
+    @ooze.factory
+    def first():
+        return 1
+
+    ooze.freeze(manifest_file)
+
+    @ooze.factory
+    def second(first):
+        return first + 1
+
+    # When
+    loaded = ooze.load_manifest(manifest_file)
+
+    # Then
+    assert not loaded
+    assert not ooze.load_manifest(tmp_path / 'missing.json')
+    assert ooze.resolve('second') == 2
+
+
+def test_freeze_reports_missing_dependencies(empty_graph, tmp_path):
+    # Given
+    @ooze.provide
+    class Mailer:
+        def __init__(self, smtp_host_that_does_not_exist):
+            pass
+
+    # When
+    with pytest.raises(ooze.InjectionError) as exc_info:
+        ooze.freeze(tmp_path / 'manifest.json')
+
+    # Then
+    assert str(exc_info.value) == \
+        'The following dependencies are missing: mailer needs smtp_host_that_does_not_exist'
+    assert not (tmp_path / 'manifest.json').exists()
+
+
+def test_concurrent_first_resolves_construct_each_class_once(empty_graph):
+    # Given
+    constructed = collections.Counter()
+    thread_count = 64
+
+    def make_class(index):
+        def __init__(self, **dependencies):
+            time.sleep(0.001)
+            constructed[index] += 1
+        parameters = ', '.join(f"service{dep}" for dep in range(max(0, index - 3), index))
+        namespace = {'init': __init__}
+        exec(f"def wrapper(self, {parameters}): init(self)", namespace)
+        return type(f"Service{index}", (), {'__init__': namespace['wrapper']})
+
+    for index in range(30):
+        ooze.provide(make_class(index))
+    barrier = threading.Barrier(thread_count)
+    results = collections.defaultdict(set)
+
+    def worker(number):
+        barrier.wait()
+        name = f"service{number % 30}"
+        results[name].add(id(ooze.resolve(name)))
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(thread_count)]
+
+    # When
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then
+    assert constructed == {index: 1 for index in range(30)}
+    assert all(len(ids) == 1 for ids in results.values())
+
+
+def test_slow_lazy_class_does_not_block_other_lazy_classes(empty_graph):
+    # Given
+    release = threading.Event()
+    started = threading.Event()
+
+    @ooze.provide(lazy=True)
+    class SlowClient:
+        def __init__(self):
+            started.set()
+            release.wait(2)
+
+    @ooze.provide(lazy=True)
+    class FastClient:
+        pass
+
+    slow_thread = threading.Thread(target=ooze.resolve, args=('slowclient',))
+    slow_thread.start()
+    started.wait(5)
+
+    # When
+    fast_client = ooze.resolve('fastclient')
+    still_building = slow_thread.is_alive()
+    release.set()
+    slow_thread.join()
+
+    # Then
+    assert still_building
+    assert isinstance(fast_client, FastClient)
+    assert isinstance(ooze.resolve('slowclient'), SlowClient)
+
+
+def test_concurrent_async_resolves_construct_once(empty_graph):
+    # Given
+    constructed = []
+
+    @ooze.provide
+    class Client:
+        async def ainit(self):
+            await asyncio.sleep(0.01)
+            constructed.append(self)
+
+    async def scenario():
+        return await asyncio.gather(*(ooze.resolve_async('client') for _ in range(10)))
+
+    # When
+    clients = asyncio.run(scenario())
+
+    # Then
+    assert constructed == [clients[0]]
+    assert all(client is clients[0] for client in clients)
+
+
+def _in_forked_child(func):
+    """Run func in a forked child process and return what it returned, round tripped through JSON."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write_fd, json.dumps(func()).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as reader:
+        return json.loads(reader.read())
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Needs os.fork')
+def test_per_process_classes_rebuilt_after_fork(empty_graph):
+    # Given
+    @ooze.provide(per_process=True)
+    class Connection:
+        def __init__(self):
+            self.pid = os.getpid()
+
+    @ooze.provide
+    class Repository:
+        def __init__(self, connection):
+            self.connection = connection
+
+    @ooze.provide
+    class Settings:
+        pass
+
+    ooze.run(lambda: None)
+    settings = ooze.resolve('settings')
+
+    # When
+    child_result = _in_forked_child(lambda: [
+        ooze.resolve('repository').connection.pid == os.getpid(),
+        ooze.resolve('connection') is ooze.resolve('repository').connection,
+        ooze.resolve('settings') is settings,
+    ])
+
+    # Then
+    assert child_result == [True, True, True]
+    assert ooze.resolve('repository').connection.pid == os.getpid()
+
+
+def test_only_classes_provided_per_process():
+    with pytest.raises(ooze.InjectionError):
+        ooze.provide('per_process_value', per_process=True)('value')
+
+
+def test_hooks_told_about_builds_and_resolutions(empty_graph):
+    # Given
+    events = []
+
+    @ooze.factory
+    def token():
+        return 'secret'
+
+    @ooze.provide
+    class Client:
+        def __init__(self, token):
+            self.token = token
+
+    hook = ooze.add_hook(events.append)
+
+    # When
+    try:
+        ooze.resolve('client')
+    finally:
+        ooze.remove_hook(hook)
+
+    # Then
+    assert [(event.kind, event.name, event.parent) for event in events] == [
+        ('factory', 'token', 'client'),
+        ('resolve', 'token', 'client'),
+        ('build', 'client', None),
+        ('resolve', 'client', None),
+    ]
+    assert events[1].resolver is ooze._resolve_dependency_factory
+    assert events[2].seconds >= events[0].seconds
+
+
+def test_profile_report_shows_slowest_dependencies_first(empty_graph, capsys):
+    # Given
+    @ooze.provide(lazy=True)
+    class Flaky:
+        attempts = 0
+
+        def __init__(self):
+            Flaky.attempts += 1
+            if Flaky.attempts == 1:
+                raise ooze.InjectionError('not yet')
+
+    @ooze.provide(lazy=True)
+    class SlowDatabase:
+        def __init__(self):
+            time.sleep(0.02)
+
+    @ooze.provide
+    class Service:
+        def __init__(self, slowdatabase):
+            pass
+
+    profiler = ooze.profile()
+
+    # When
+    try:
+        ooze.run(lambda service: None)
+        with pytest.raises(ooze.InjectionError):
+            ooze.resolve('flaky')
+        ooze.resolve('flaky')
+        ooze.profile_report()
+        ooze.profile_report(tree=True)
+    finally:
+        ooze.profile(False)
+
+    # Then
+    lines = capsys.readouterr().out.splitlines()
+    assert profiler.dependencies['slowdatabase'].seconds >= 0.02
+    assert profiler.dependencies['flaky'].failures == 1
+    assert profiler.dependencies['flaky'].calls == 1
+    assert profiler.dependencies['service'].resolutions == 1
+    assert lines[0].startswith('Dependency')
+    assert lines[1].startswith('service')
+    assert lines[2].startswith('slowdatabase')
+    assert lines[4].startswith('service ')
+    assert lines[5].startswith('  slowdatabase ')
+
+
+class Storage:
+    pass
+
+
+@typing.runtime_checkable
+class Notifier(typing.Protocol):
+    def notify(self, message):
+        ...
+
+
+def test_typed_injection_resolves_base_class_without_asking_environment(typed_graph, environment):
+    # Given
+    environment.setenv('STORAGE', 'from the environment')
+    environment.setenv('REGION', 'eu-west-1')
+    ooze.reload_environment()
+
+    @ooze.provide
+    class DiskStorage(Storage):
+        pass
+
+    @ooze.provide
+    class Archive:
+        def __init__(self, storage: Storage, region: str):
+            self.storage = storage
+            self.region = region
+
+    # When
+    archive = ooze.resolve('archive')
+
+    # Then
+    assert isinstance(archive.storage, DiskStorage)
+    assert archive.storage is ooze.resolve('diskstorage')
+    assert archive.region == 'eu-west-1'
+
+
+def test_typed_injection_matches_runtime_protocols(typed_graph):
+    # Given
+    class EmailNotifier:
+        def notify(self, message):
+            return f"emailed {message}"
+
+    @ooze.factory
+    def email() -> EmailNotifier:
+        return EmailNotifier()
+
+    @ooze.magic
+    def alert(message, notifier: Notifier):
+        return notifier.notify(message)
+
+    # When
+    result = alert('disk full')
+
+    # Then
+    assert result == 'emailed disk full'
+
+
+def test_typed_injection_prefers_provider_named_like_parameter(typed_graph):
+    # Given
+    @ooze.provide
+    class Primary(Storage):
+        pass
+
+    @ooze.provide
+    class Replica(Storage):
+        pass
+
+    @ooze.magic
+    def use_replica(replica: Storage):
+        return replica
+
+    @ooze.magic
+    def use_either(storage: Storage):
+        return storage
+
+    # When / Then
+    assert isinstance(use_replica(), Replica)
+    with pytest.raises(ooze.InjectionError, match='primary, replica'):
+        use_either()
+
+
+def test_typed_injection_orders_startup_by_type(typed_graph):
+    # Given
+    @ooze.provide
+    class Consumer:
+        def __init__(self, source: Storage):
+            self.source = source
+
+    @ooze.provide
+    class Cloud(Storage):
+        pass
+
+    # When
+    ooze.run(lambda consumer: None)
+
+    # Then
+    assert ooze.instantiation_order() == ['cloud', 'consumer']
@@ -1,4 +1,13 @@
 """Unit tests for the ooze.pool module"""
+import asyncio
+import gc
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
 
 import ooze.pool
 
@@ -7,6 +16,7 @@ class SampleThing:
     def __init__(self):
         self.closed = False
         self.allocated = False
+        self.broken = False
 
 
 def create_item():
@@ -68,3 +78,403 @@ def test_pool_size():
 
     # Then
     assert len(sut.items) == 1  # Assert pool on grew to size 1
+
+
+def test_pool_reuses_most_recently_returned_item():
+    # Given
+    sut = ooze.pool.Pool(create_item)
+    with sut.item() as first:
+        with sut.item() as second:
+            pass
+
+    # When
+    with sut.item() as item:
+        # Then
+        assert item is first
+
+
+def test_pool_max_size_times_out():
+    # Given
+    sut = ooze.pool.Pool(create_item, max_size=1, timeout=0.05)
+
+    # When
+    with sut.item():
+        with pytest.raises(ooze.pool.PoolTimeoutError):
+            sut.item()
+
+    # Then
+    with sut.item(timeout=0) as item:
+        assert item.allocated
+
+
+def test_pool_max_size_waits_for_returned_item():
+    # Given
+    created = []
+    sut = ooze.pool.Pool(lambda: created.append(SampleThing()) or created[-1], max_size=1)
+    borrowed = sut.item()
+    held = borrowed.__enter__()
+    threading.Timer(0.05, borrowed.__exit__, (None, None, None)).start()
+
+    # When
+    with sut.item(timeout=1) as item:
+        # Then
+        assert item is held
+    assert len(created) == 1
+
+
+def test_pool_failed_create_frees_slot():
+    # Given
+    attempts = []
+
+    def flaky_create():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError('database down')
+        return SampleThing()
+
+    sut = ooze.pool.Pool(flaky_create, max_size=1, timeout=0)
+
+    # When
+    with pytest.raises(ConnectionError):
+        sut.item()
+
+    # Then
+    with sut.item() as item:
+        assert isinstance(item, SampleThing)
+
+
+def test_async_pool():
+    # Given
+    async def create():
+        await asyncio.sleep(0)
+        return create_item()
+
+    async def teardown(item):
+        teardown_item(item)
+
+    sut = ooze.pool.AsyncPool(create, reclaim_item, teardown, pool_size=1)
+
+    async def scenario():
+        async with sut.item() as item:
+            async with sut.item() as item_2:
+                assert item.allocated and item_2.allocated
+        async with sut.item() as reused:
+            assert reused is item
+            assert item_2.closed
+        await sut.close()
+        return item, item_2
+
+    # When
+    item, item_2 = asyncio.run(scenario())
+
+    # Then
+    assert item.closed
+    assert item_2.closed
+    assert len(sut.items) == 0
+
+
+def test_async_pool_max_size_queues_borrowers():
+    # Given
+    sut = ooze.pool.AsyncPool(create_item, max_size=2)
+    in_use = []
+    most_in_use = []
+
+    async def borrow():
+        async with sut.item() as item:
+            in_use.append(item)
+            most_in_use.append(len(in_use))
+            await asyncio.sleep(0.01)
+            in_use.remove(item)
+
+    async def scenario():
+        await asyncio.gather(*(borrow() for _ in range(10)))
+
+    # When
+    asyncio.run(asyncio.wait_for(scenario(), 1))
+
+    # Then
+    assert max(most_in_use) == 2
+    assert len(sut.items) == 2
+
+
+def test_async_pool_times_out():
+    # Given
+    sut = ooze.pool.AsyncPool(create_item, max_size=1, timeout=0.01)
+
+    async def scenario():
+        async with sut.item():
+            async with sut.item():
+                pass
+
+    # When / Then
+    with pytest.raises(ooze.pool.PoolTimeoutError):
+        asyncio.run(scenario())
+
+
+def test_async_pool_tears_down_items_that_fail_reclaim():
+    # Given
+    def reclaim(item):
+        raise RuntimeError('connection reset')
+
+    sut = ooze.pool.AsyncPool(create_item, reclaim, teardown_item, max_size=1)
+
+    borrowed = []
+
+    async def scenario():
+        async with sut.item() as item:
+            borrowed.append(item)
+
+    # When
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
+
+    # Then
+    stats = sut.stats()
+    assert (stats.idle, stats.in_use, stats.teardowns) == (0, 0, 1)
+    assert borrowed[0].closed
+
+
+def test_pool_rejects_invalid_sizes_cleanly():
+    # Given
+    unraisable = []
+    hook = sys.unraisablehook
+    sys.unraisablehook = unraisable.append
+
+    # When
+    try:
+        with pytest.raises(ValueError):
+            ooze.pool.Pool(create_item, pool_size=1, min_idle=2)
+        gc.collect()
+    finally:
+        sys.unraisablehook = hook
+
+    # Then
+    assert unraisable == []
+
+
+def test_pool_validates_on_borrow():
+    # Given
+    sut = ooze.pool.Pool(create_item, teardown=teardown_item, validate=lambda item: not item.broken)
+    with sut.item() as broken:
+        broken.broken = True
+
+    # When
+    with sut.item() as item:
+        # Then
+        assert item is not broken
+    assert broken.closed
+
+
+def test_pool_recycles_items_past_max_lifetime():
+    # Given
+    sut = ooze.pool.Pool(create_item, teardown=teardown_item, max_lifetime=0.05)
+    with sut.item() as old:
+        pass
+    time.sleep(0.06)
+
+    # When
+    with sut.item() as item:
+        # Then
+        assert item is not old
+    assert old.closed
+
+
+def test_pool_evicts_idle_items_down_to_min_idle():
+    # Given
+    sut = ooze.pool.Pool(create_item, teardown=teardown_item, idle_timeout=0.05, min_idle=1,
+                         maintenance_interval=60)
+    with sut.item() as first:
+        with sut.item() as second:
+            with sut.item() as third:
+                pass
+    time.sleep(0.06)
+
+    # When
+    sut.maintain()
+
+    # Then
+    assert sut.items == [first]
+    assert third.closed and second.closed and not first.closed
+
+
+def test_pool_prefills_min_idle_in_background():
+    # Given
+    sut = ooze.pool.Pool(create_item, min_idle=2, maintenance_interval=0.01)
+
+    # When
+    deadline = time.monotonic() + 1
+    while len(sut.items) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Then
+    assert len(sut.items) == 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Needs os.fork')
+def test_forked_child_starts_with_empty_pool():
+    # Given
+    torn_down = []
+    pool = ooze.pool.Pool(create_item, teardown=torn_down.append, max_size=1)
+    with pool.item() as parent_item:
+        pass
+    read_fd, write_fd = os.pipe()
+
+    # When
+    pid = os.fork()
+    if pid == 0:
+        try:
+            with pool.item(timeout=1) as child_item:
+                result = [len(pool.items), child_item is parent_item, len(torn_down)]
+            os.write(write_fd, json.dumps(result).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as reader:
+        child_result = json.loads(reader.read())
+
+    # Then
+    assert child_result == [0, False, 0]
+    assert pool.items == [parent_item]
+
+
+def test_pool_stats_counts_borrows_creates_and_teardowns():
+    # Given
+    sut = ooze.pool.Pool(create_item, teardown=teardown_item, pool_size=1)
+
+    # When
+    with sut.item():
+        with sut.item():
+            during = sut.stats()
+    with sut.item():
+        pass
+    stats = sut.stats()
+
+    # Then
+    assert (during.idle, during.in_use) == (0, 2)
+    assert (stats.borrows, stats.creates, stats.teardowns, stats.idle, stats.in_use) == (3, 2, 1, 1, 0)
+    assert stats.wait.count == stats.hold.count == 3
+
+
+def test_pool_stats_counts_timeouts():
+    # Given
+    sut = ooze.pool.Pool(create_item, max_size=1, timeout=0)
+
+    # When
+    with sut.item():
+        with pytest.raises(ooze.pool.PoolTimeoutError):
+            sut.item()
+
+    # Then
+    assert sut.stats().timeouts == 1
+
+
+def test_pool_stats_adds_up_every_thread():
+    # Given
+    sut = ooze.pool.Pool(create_item)
+
+    def borrow():
+        for _ in range(300):
+            with sut.item():
+                pass
+
+    # When
+    threads = [threading.Thread(target=borrow) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then
+    stats = sut.stats()
+    assert stats.borrows == 1200
+    assert sum(stats.wait.counts) == sum(stats.hold.counts) == 1200
+
+
+def test_pool_stats_retires_finished_threads():
+    # Given
+    sut = ooze.pool.Pool(create_item)
+
+    def borrow():
+        for _ in range(3):
+            with sut.item():
+                pass
+
+    # When
+    for _ in range(20):
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        thread.join()
+    stats = sut.stats()
+
+    # Then
+    assert stats.borrows == 60
+    assert sut._metrics._shards == []
+
+
+def test_pool_stats_measures_hold_time():
+    # Given
+    sut = ooze.pool.Pool(create_item)
+
+    # When
+    with sut.item():
+        time.sleep(0.02)
+
+    # Then
+    hold = sut.stats().hold
+    assert hold.sum >= 0.02
+    assert hold.quantile(0.5) == 0.05
+
+
+def test_histogram_quantile():
+    # Given
+    sut = ooze.pool.Histogram(buckets=(1, 2, 3))
+
+    # When
+    sut.observe_many([0.5, 1, 1.5, 2.5])
+    sut.observe(10)
+
+    # Then
+    snapshot = sut.snapshot()
+    assert snapshot.counts == (2, 1, 1, 1)
+    assert (snapshot.quantile(0.4), snapshot.quantile(0.6), snapshot.quantile(0.8)) == (1, 2, 3)
+    assert snapshot.quantile(1) == 10
+    assert ooze.pool.Histogram().snapshot().quantile(0.5) is None
+
+
+def test_collect_stats_of_named_pools():
+    # Given
+    named = ooze.pool.Pool(create_item, name='test-collect')
+    ooze.pool.Pool(create_item)
+    with named.item():
+        pass
+
+    # When
+    collected = ooze.pool.collect_stats()
+
+    # Then
+    assert collected['test-collect'].borrows == 1
+    assert None not in collected
+
+
+def test_async_pool_stats():
+    # Given
+    sut = ooze.pool.AsyncPool(create_item, teardown=teardown_item, pool_size=1, max_size=2, timeout=0.01)
+
+    async def scenario():
+        async with sut.item():
+            async with sut.item():
+                during = sut.stats()
+                with pytest.raises(ooze.pool.PoolTimeoutError):
+                    async with sut.item():
+                        pass
+        return during
+
+    # When
+    during = asyncio.run(scenario())
+    stats = sut.stats()
+
+    # Then
+    assert (during.idle, during.in_use) == (0, 2)
+    assert (stats.borrows, stats.creates, stats.teardowns, stats.timeouts) == (2, 2, 1, 1)
+    assert (stats.idle, stats.in_use) == (1, 0)